@@ -0,0 +1,299 @@
+import heapq
+import math
+import random
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:  # The array-backed variant is optional
+    np = None
+
+# Bandit policies that rank servers by energy efficiency from the stream of
+# agent reports. All of them share the BanditPolicy interface so the Tofino
+# controller and bandit_replay.py can swap them by name (see POLICIES).
+#
+# D-UCB: every report decays all servers' pull counts and rewards by gamma. Instead
+# of touching every host, we keep one global epoch (number of reports) and
+# the epoch at which each host was last updated; a host's decayed value is
+# materialised as stored * gamma ** (epoch - stamp) only when it is read.
+# Updates are O(1) regardless of pool size.
+
+MAB_GAMMA = 0.95    # Decay factor (closer to 1 = longer memory)
+MAB_WINDOW = 200    # Reports remembered by the sliding-window UCB
+EXP3_GAMMA = 0.1    # EXP3 exploration rate
+EXP3_ETA = 0.1      # EXP3 learning rate per report
+
+
+class BanditPolicy:
+    """Ranks servers from (host, reward) observations; higher score is better."""
+
+    def update(self, host, reward):
+        raise NotImplementedError
+
+    def score(self, host):
+        raise NotImplementedError
+
+    def known_hosts(self):
+        raise NotImplementedError
+
+    def top(self, n, hosts=None):
+        """Best n hosts as [(host, score)]."""
+        hosts = self.known_hosts() if hosts is None else hosts
+        return heapq.nlargest(n, ((h, self.score(h)) for h in hosts), key=lambda x: x[1])
+
+
+class DiscountedUCB(BanditPolicy):
+    def __init__(self, gamma=MAB_GAMMA):
+        self.gamma = gamma
+        self.epoch = 0          # Reports seen; also the undecayed total pull count
+        self.counts = {}        # host -> decayed pulls as of stamps[host]
+        self.values = {}        # host -> decayed reward as of stamps[host]
+        self.stamps = {}        # host -> epoch of the host's last update
+
+    @property
+    def total_pulls(self):
+        return self.epoch
+
+    def __contains__(self, host):
+        return host in self.stamps
+
+    def known_hosts(self):
+        return self.stamps.keys()
+
+    def update(self, host, reward):
+        """Decays every server by one step and credits the reporting one."""
+        self.epoch += 1
+        stamp = self.stamps.get(host)
+        if stamp is None:
+            count, value = 0.0, 0.0
+        else:
+            decay = self.gamma ** (self.epoch - stamp)
+            count, value = self.counts[host] * decay, self.values[host] * decay
+        self.counts[host] = count + 1
+        self.values[host] = value + reward
+        self.stamps[host] = self.epoch
+
+    def decayed(self, host):
+        """Returns the host's (count, value) at the current epoch."""
+        stamp = self.stamps.get(host)
+        if stamp is None:
+            return 0.0, 0.0
+        decay = self.gamma ** (self.epoch - stamp)
+        return self.counts[host] * decay, self.values[host] * decay
+
+    def score(self, host):
+        return self.ucb(host)
+
+    def ucb(self, host):
+        count, value = self.decayed(host)
+        # Initialization Phase: If we have no data, prioritize exploring it
+        if count == 0:
+            return float('inf')
+        # Exploitation (decayed reward) plus the uncertainty bonus
+        exploration = 0.0
+        if self.epoch > 1:
+            exploration = math.sqrt((2 * math.log(self.epoch)) / count)
+        return value + exploration
+
+
+class ArrayDiscountedUCB(DiscountedUCB):
+    """D-UCB backed by NumPy arrays, scoring the whole pool in one pass.
+
+    update() is still O(1); top() materialises every host with vectorised
+    operations, which beats per-host Python calls for large pools.
+    """
+
+    def __init__(self, gamma=MAB_GAMMA, capacity=1024):
+        if np is None:
+            raise ImportError("ArrayDiscountedUCB requires numpy")
+        self.gamma = gamma
+        self.epoch = 0
+        self.index = {}         # host -> row
+        self.hosts = []         # row -> host
+        self.counts = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.stamps = np.zeros(capacity, dtype=np.int64)
+
+    def __contains__(self, host):
+        return host in self.index
+
+    def known_hosts(self):
+        return self.index.keys()
+
+    def _row(self, host):
+        row = self.index.get(host)
+        if row is None:
+            row = len(self.hosts)
+            if row == len(self.counts):
+                grow = len(self.counts)
+                self.counts = np.concatenate([self.counts, np.zeros(grow)])
+                self.values = np.concatenate([self.values, np.zeros(grow)])
+                self.stamps = np.concatenate([self.stamps, np.zeros(grow, dtype=np.int64)])
+            self.index[host] = row
+            self.hosts.append(host)
+        return row
+
+    def update(self, host, reward):
+        self.epoch += 1
+        row = self._row(host)
+        decay = self.gamma ** (self.epoch - self.stamps[row])
+        self.counts[row] = self.counts[row] * decay + 1
+        self.values[row] = self.values[row] * decay + reward
+        self.stamps[row] = self.epoch
+
+    def decayed(self, host):
+        row = self.index.get(host)
+        if row is None:
+            return 0.0, 0.0
+        decay = self.gamma ** (self.epoch - self.stamps[row])
+        return float(self.counts[row] * decay), float(self.values[row] * decay)
+
+    def ucb_all(self):
+        """UCB of every known host, in row order."""
+        n = len(self.hosts)
+        decay = np.power(self.gamma, self.epoch - self.stamps[:n])
+        counts = self.counts[:n] * decay
+        values = self.values[:n] * decay
+        bonus = np.zeros(n)
+        explored = counts > 0
+        if self.epoch > 1:
+            bonus[explored] = np.sqrt(2 * math.log(self.epoch) / counts[explored])
+        scores = values + bonus
+        scores[~explored] = np.inf
+        return scores
+
+    def top(self, n, hosts=None):
+        if hosts is not None:
+            return super().top(n, hosts)
+        if not self.hosts:
+            return []
+        scores = self.ucb_all()
+        n = min(n, len(scores))
+        best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(self.hosts[i], float(scores[i])) for i in best]
+
+
+class SlidingWindowUCB(BanditPolicy):
+    """UCB over the last `window` reports only (SW-UCB)."""
+
+    def __init__(self, window=MAB_WINDOW):
+        self.window = window
+        self.epoch = 0
+        self.history = deque()  # (host, reward) in arrival order
+        self.counts = {}        # host -> reports inside the window
+        self.sums = {}          # host -> reward sum inside the window
+
+    def known_hosts(self):
+        return self.counts.keys()
+
+    def update(self, host, reward):
+        self.epoch += 1
+        self.history.append((host, reward))
+        self.counts[host] = self.counts.get(host, 0) + 1
+        self.sums[host] = self.sums.get(host, 0.0) + reward
+        if len(self.history) > self.window:
+            old_host, old_reward = self.history.popleft()
+            self.counts[old_host] -= 1
+            self.sums[old_host] -= old_reward
+
+    def score(self, host):
+        count = self.counts.get(host, 0)
+        if count == 0:
+            return float('inf')
+        horizon = min(self.epoch, self.window)
+        exploration = math.sqrt(2 * math.log(horizon) / count) if horizon > 1 else 0.0
+        return self.sums[host] / count + exploration
+
+
+class DiscountedThompson(DiscountedUCB):
+    """Thompson sampling on discounted Gaussian reward statistics.
+
+    Each score is a draw from N(decayed mean, sigma^2 / decayed count), so
+    rankings are randomised in proportion to the remaining uncertainty.
+    """
+
+    def __init__(self, gamma=MAB_GAMMA, sigma=1.0, seed=None):
+        super().__init__(gamma)
+        self.sigma = sigma
+        self.rng = random.Random(seed)
+
+    def score(self, host):
+        count, value = self.decayed(host)
+        if count == 0:
+            return float('inf')
+        return self.rng.gauss(value / count, self.sigma / math.sqrt(count))
+
+
+class EXP3(BanditPolicy):
+    """Exponential-weight policy with gamma-uniform exploration.
+
+    Every server reports whether or not it was picked, so the feedback is
+    full-information: each report adds eta * reward to the reporter's log
+    weight (Hedge). EXP3's importance weighting (reward / p) is only
+    unbiased when the picked arm alone is observed; applied to every report
+    it lets low-probability servers catch up and the policy never settles.
+    Rewards are scaled to [0, 1] by the largest reward seen so far. Weights
+    are kept in log space so they never overflow.
+    """
+
+    def __init__(self, gamma=EXP3_GAMMA, eta=EXP3_ETA, seed=None):
+        self.gamma = gamma
+        self.eta = eta
+        self.log_weights = {}
+        self.max_reward = 0.0
+        self.rng = random.Random(seed)
+
+    def known_hosts(self):
+        return self.log_weights.keys()
+
+    def probabilities(self):
+        if not self.log_weights:
+            return {}
+        top = max(self.log_weights.values())
+        weights = {h: math.exp(w - top) for h, w in self.log_weights.items()}
+        total = sum(weights.values())
+        k = len(weights)
+        return {h: (1 - self.gamma) * w / total + self.gamma / k for h, w in weights.items()}
+
+    def update(self, host, reward):
+        if host not in self.log_weights:
+            # Newcomers start level with the current leader
+            self.log_weights[host] = max(self.log_weights.values(), default=0.0)
+        self.max_reward = max(self.max_reward, reward)
+        if self.max_reward <= 0:
+            return
+        x = min(1.0, max(0.0, reward / self.max_reward))
+        self.log_weights[host] += self.eta * x
+
+    def score(self, host):
+        return self.probabilities().get(host, 0.0)
+
+    def top(self, n, hosts=None):
+        """Samples n distinct hosts according to the EXP3 distribution."""
+        probs = self.probabilities()
+        if hosts is not None:
+            probs = {h: probs.get(h, 0.0) for h in hosts}
+        ordered = []
+        while probs and len(ordered) < n:
+            pick = self.rng.random() * sum(probs.values())
+            for host, p in probs.items():
+                pick -= p
+                if pick <= 0:
+                    break
+            ordered.append((host, probs.pop(host)))
+        return ordered
+
+
+POLICIES = {
+    "d-ucb": DiscountedUCB,
+    "sw-ucb": SlidingWindowUCB,
+    "d-ts": DiscountedThompson,
+    "exp3": EXP3,
+}
+
+
+def make_policy(name, **kwargs):
+    if name not in POLICIES:
+        raise ValueError(f"Unknown bandit policy '{name}' (choose from {sorted(POLICIES)})")
+    return POLICIES[name](**kwargs)
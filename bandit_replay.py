@@ -0,0 +1,127 @@
+"""Offline replay of the bandit policies over server_agent energy logs.
+
+Merges the {host}_energy.csv logs by timestamp and steps through them one
+decision tick at a time. Before each tick every policy picks a server from
+the reports seen so far; the pick then earns that server's efficiency score
+over the tick, while the oracle earns the best score of any server. The
+cumulative gap is the policy's energy-efficiency regret.
+
+The logs hold every server's report regardless of where traffic went, so
+the replay treats them as full-information feedback; it ranks policies
+against each other, it does not predict absolute efficiency.
+
+--check skips the logs and feeds each policy fixed rewards (one server
+always better than the rest) to confirm it settles on the best server.
+
+    python3 bandit_replay.py sift/logs/h2_energy.csv sift/logs/h3_energy.csv
+    python3 bandit_replay.py --check
+"""
+import argparse
+import csv
+import sys
+
+from bandit_policies import POLICIES, make_policy
+
+TICK = 0.5  # Matches the agent reporting interval
+CHECK_REWARDS = {"best": 1.0, "other": 0.5}
+CHECK_ROUNDS = 500
+CHECK_SHARE = 0.8  # Best-server share of second-half picks; exploration keeps it below 1
+
+
+def load_reports(paths):
+    """Returns [(timestamp, host, efficiency_score)] sorted by time."""
+    reports = []
+    for path in paths:
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                try:
+                    reports.append(
+                        (float(row["timestamp"]), row["host"], float(row["efficiency_score"])))
+                except (KeyError, ValueError):
+                    continue  # Truncated or malformed line
+    reports.sort(key=lambda r: r[0])
+    return reports
+
+
+def replay(policy, reports, tick=TICK):
+    """Replays reports through policy; returns (ticks, reward, oracle reward)."""
+    latest = {}
+    ticks = 0
+    earned = 0.0
+    best = 0.0
+    i = 0
+    t = reports[0][0] if reports else 0.0
+    while i < len(reports):
+        t += tick
+        ordered = policy.top(1, hosts=list(latest)) if latest else []
+        while i < len(reports) and reports[i][0] < t:
+            _, host, score = reports[i]
+            policy.update(host, score)
+            latest[host] = score
+            i += 1
+        if not ordered:
+            continue
+        ticks += 1
+        earned += latest[ordered[0][0]]
+        best += max(latest.values())
+    return ticks, earned, best
+
+
+def check_convergence(policy, rewards=CHECK_REWARDS, rounds=CHECK_ROUNDS):
+    """Every round each server reports its fixed reward, then the policy
+    picks one; returns the share of the second half's picks that went to
+    the best server."""
+    best = max(rewards, key=rewards.get)
+    hits = 0
+    for r in range(rounds):
+        for host, reward in rewards.items():
+            policy.update(host, reward)
+        if r >= rounds // 2 and policy.top(1, hosts=list(rewards))[0][0] == best:
+            hits += 1
+    return hits / (rounds - rounds // 2)
+
+
+def policy_kwargs(name, seed):
+    return {"seed": seed} if name in ("d-ts", "exp3") else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("logs", nargs="*", help="{host}_energy.csv files written by server_agent")
+    parser.add_argument("--tick", type=float, default=TICK, help="Decision interval (s)")
+    parser.add_argument("--policies", default=",".join(POLICIES),
+                        help="Comma-separated policy names")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for randomised policies")
+    parser.add_argument("--check", action="store_true",
+                        help="Check that each policy converges to the best server")
+    args = parser.parse_args()
+
+    if args.check:
+        failed = 0
+        rewards = ", ".join(f"{h}={r}" for h, r in CHECK_REWARDS.items())
+        print(f"Convergence over {CHECK_ROUNDS} rounds ({rewards}), need {CHECK_SHARE:.0%} best picks")
+        for name in args.policies.split(","):
+            share = check_convergence(make_policy(name, **policy_kwargs(name, args.seed)))
+            ok = share >= CHECK_SHARE
+            failed += not ok
+            print(f"{name:>8} {share:>8.1%} {'ok' if ok else 'FAIL'}")
+        sys.exit(1 if failed else 0)
+    if not args.logs:
+        parser.error("give energy logs to replay, or --check")
+
+    reports = load_reports(args.logs)
+    if not reports:
+        parser.error("no reports found in the given logs")
+    print(f"Replaying {len(reports)} reports from {len(set(r[1] for r in reports))} hosts")
+
+    print(f"{'policy':>8} {'ticks':>8} {'reward':>14} {'oracle':>14} {'regret':>14} {'regret/tick':>12}")
+    for name in args.policies.split(","):
+        ticks, earned, best = replay(make_policy(name, **policy_kwargs(name, args.seed)),
+                                     reports, args.tick)
+        regret = best - earned
+        per_tick = regret / ticks if ticks else 0.0
+        print(f"{name:>8} {ticks:>8} {earned:>14.3f} {best:>14.3f} {regret:>14.3f} {per_tick:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Decision-latency benchmark for the load-balancer controller core.
+
+Synthetic agents in a separate process send binary telemetry at a fixed rate
+to a controller wired either to the bmv2 MyLBController over
+FakeSwitchConnection (P4Runtime encoding included) or to the in-memory
+switch backend, which needs no P4 toolchain. Reported per case:
+telemetry-to-table-write latency percentiles (send timestamp of the first
+report behind a decision -> completion of the write it caused) and
+controller CPU time per message.
+
+Run from the repository root after `make build`:
+    python3 benchmarks/controller_bench.py --rates 1000,10000,50000 --hosts 2,100,5000
+or anywhere, without the P4 build:
+    python3 benchmarks/controller_bench.py --backend memory --hosts 100,5000
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+import controller_core
+import telemetry_ingest
+import telemetry_protocol
+from decision_damper import DecisionDamper
+from switch_backend import InMemoryBackend, synthetic_server_info
+
+SEND_SLICE = 0.001  # Sender wakes up every millisecond
+
+
+def send_telemetry(port, hosts, rate, duration, batch, sent):
+    """Sender process: round-robins over hosts at `rate` samples/s."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rng = random.Random(0)
+    scores = {h: rng.uniform(1.0, 10.0) for h in hosts}
+    seq = 0
+    owed = 0.0
+    next_t = time.monotonic()
+    end = next_t + duration
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            break
+        if now < next_t:
+            time.sleep(next_t - now)
+            continue
+        next_t += SEND_SLICE
+        owed += rate * SEND_SLICE
+        n = int(owed)
+        owed -= n
+        pending = []
+        for _ in range(n):
+            host = hosts[seq % len(hosts)]
+            score = max(0.1, scores[host] * (1.0 + rng.gauss(0.0, 0.05)))
+            scores[host] = score
+            util = rng.uniform(10.0, 90.0)
+            pending.append(telemetry_protocol.TelemetrySample(
+                host, seq, time.monotonic(), 10.0 + util * 0.5, util, score * 20.0, score))
+            seq += 1
+            if len(pending) == batch:
+                sock.sendto(telemetry_protocol.pack_samples(pending), ("127.0.0.1", port))
+                pending = []
+        if pending:
+            sock.sendto(telemetry_protocol.pack_samples(pending), ("127.0.0.1", port))
+    sent.value = seq
+
+
+class LatencyTracker:
+    """Pairs the oldest report behind each recompute with the write it caused."""
+
+    def __init__(self, switch):
+        self.switch = switch
+        self.first_pending = None
+        self.latencies = []
+
+    def wrap(self, ctrl):
+        recompute = ctrl.recompute_and_update
+
+        def tracked(*args, **kwargs):
+            first, self.first_pending = self.first_pending, None
+            calls = self.switch.write_calls
+            recompute(*args, **kwargs)
+            if first is not None and self.switch.write_calls > calls:
+                self.latencies.append(self.switch.last_write_done - first)
+
+        ctrl.recompute_and_update = tracked
+
+
+class BenchProtocol(telemetry_ingest.TelemetryProtocol):
+    def __init__(self, controller, tracker):
+        super().__init__(controller)
+        self.tracker = tracker
+
+    def on_samples(self, samples):
+        if self.tracker.first_pending is None and samples[0].timestamp is not None:
+            self.tracker.first_pending = min(s.timestamp for s in samples)
+        super().on_samples(samples)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_controller(args, n_hosts, damper):
+    """Returns (controller, switch, hosts, restore).
+
+    switch counts the writes; restore() undoes changes to module state.
+    """
+    extra = synthetic_server_info(n_hosts)
+    if args.backend == "memory":
+        switch = InMemoryBackend(extra, write_latency=args.write_latency / 1000.0)
+        ctrl = controller_core.LBController(
+            switch, tick_interval=args.tick / 1000.0, ecmp_mode=args.ecmp_mode,
+            higher_score_first=False, damper=damper, metrics_port=None, listen=False,
+        )
+        return ctrl, switch, list(extra), lambda: None
+
+    import energy_aware_controller as controller
+    from fake_switch import FakeSwitchConnection
+    saved_info = dict(controller.SERVER_INFO)
+    controller.SERVER_INFO.update(extra)
+    switch = FakeSwitchConnection(write_latency=args.write_latency / 1000.0)
+    ctrl = controller.MyLBController(
+        args.p4info, args.bmv2_json, tick_interval=args.tick / 1000.0,
+        ecmp_mode=args.ecmp_mode, damper=damper, metrics_port=None,
+        switch_conn=switch, listen=False,
+    )
+
+    def restore():
+        controller.SERVER_INFO.clear()
+        controller.SERVER_INFO.update(saved_info)
+    return ctrl, switch, list(extra), restore
+
+
+def run_case(args, rate, n_hosts, port):
+    if args.damper:
+        damper = DecisionDamper(higher_is_better=False)
+    else:
+        damper = DecisionDamper(hysteresis=0.0, min_dwell=0.0, max_writes_per_sec=1e9, burst=1,
+                                higher_is_better=False)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        ctrl, switch, hosts, restore = make_controller(args, n_hosts, damper)
+        tracker = LatencyTracker(switch)
+        tracker.wrap(ctrl)
+        writes_before = switch.write_calls
+        threading.Thread(
+            target=ctrl.run_listener,
+            kwargs={"port": port, "protocol_cls": lambda c: BenchProtocol(c, tracker)},
+            daemon=True,
+        ).start()
+        time.sleep(0.3)  # Let the listener bind
+
+        sent = multiprocessing.Value("q", 0)
+        sender = multiprocessing.Process(
+            target=send_telemetry, args=(port, hosts, rate, args.duration, args.batch, sent))
+        cpu_start = cpu_seconds()
+        sender.start()
+        sender.join()
+        time.sleep(2 * args.tick / 1000.0 + 0.2)  # Drain the last tick
+        cpu = cpu_seconds() - cpu_start
+
+    received = sum(ctrl.metrics.telemetry_messages.values.values())
+    policy = ctrl.metrics.policy_eval
+    lat = sorted(x * 1000.0 for x in tracker.latencies)
+    restore()
+    return {
+        "rate": rate,
+        "hosts": n_hosts,
+        "sent": sent.value,
+        "received": received,
+        "loss_pct": 100.0 * (1 - received / sent.value) if sent.value else 0.0,
+        "writes": switch.write_calls - writes_before,
+        "p50_ms": percentile(lat, 50),
+        "p90_ms": percentile(lat, 90),
+        "p99_ms": percentile(lat, 99),
+        "max_ms": lat[-1] if lat else float("nan"),
+        "cpu_us_per_msg": 1e6 * cpu / received if received else float("nan"),
+        "policy_ms": 1000.0 * policy.sum / policy.count if policy.count else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=("bmv2", "memory"), default="bmv2",
+                        help="bmv2: P4Runtime over a fake switch; memory: in-memory tables")
+    parser.add_argument("--p4info", default="build/load_balance.p4.p4info.txtpb")
+    parser.add_argument("--bmv2-json", default="build/load_balance.json")
+    parser.add_argument("--rates", default="1000,10000,50000",
+                        help="Comma-separated telemetry rates (messages/s)")
+    parser.add_argument("--hosts", default="2,100,5000",
+                        help="Comma-separated backend pool sizes")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per case")
+    parser.add_argument("--batch", type=int, default=1, help="Samples per datagram")
+    parser.add_argument("--tick", type=float, default=telemetry_ingest.TICK_INTERVAL * 1000.0,
+                        help="Controller tick (ms)")
+    parser.add_argument("--write-latency", type=float, default=0.0,
+                        help="Injected latency per Write RPC (ms)")
+    parser.add_argument("--ecmp-mode", choices=controller_core.ECMP_MODES, default="priority")
+    parser.add_argument("--damper", action="store_true",
+                        help="Keep the default decision damper (off: every decision writes)")
+    parser.add_argument("--port", type=int, default=51001, help="First UDP port to use")
+    args = parser.parse_args()
+
+    rates = [int(r) for r in args.rates.split(",")]
+    pools = [int(h) for h in args.hosts.split(",")]
+    columns = ["rate", "hosts", "sent", "received", "loss_pct", "writes",
+               "p50_ms", "p90_ms", "p99_ms", "max_ms", "cpu_us_per_msg", "policy_ms"]
+    print(" ".join(f"{c:>14}" for c in columns))
+    port = args.port
+    for n_hosts in pools:
+        for rate in rates:
+            row = run_case(args, rate, n_hosts, port)
+            port += 1  # Listeners of earlier cases keep their port
+            print(" ".join(
+                f"{row[c]:>14.3f}" if isinstance(row[c], float) else f"{row[c]:>14}"
+                for c in columns
+            ), flush=True)
+
+
+if __name__ == "__main__":
+    main()
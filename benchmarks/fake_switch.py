@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+import energy_aware_controller  # noqa: F401  (puts the P4 utils on sys.path)
+from p4.v1 import p4runtime_pb2
+from table_shadow import entry_key
+
+
+class FakeSwitchConnection:
+    """In-process stand-in for Bmv2SwitchConnection.
+
+    Keeps the table entries it is given, counts every write and can delay
+    each Write RPC by write_latency seconds to mimic a remote switch.
+    """
+
+    def __init__(self, write_latency=0.0, device_id=0):
+        self.device_id = device_id
+        self.write_latency = write_latency
+        self.entries = {}
+        self.registers = {}  # (register_id, index) -> data bitstring
+        self.cookie = None
+        self.write_calls = 0
+        self.updates_written = 0
+        self.conflicts = 0  # INSERT of an existing key, or DELETE/MODIFY of a missing one
+        self.last_write_done = None
+
+    def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
+        return None
+
+    def SetForwardingPipelineConfig(self, p4info, dry_run=False, cookie=None, **kwargs):
+        self.entries = {}
+        self.registers = {}
+        self.cookie = cookie
+
+    def GetForwardingPipelineCookie(self):
+        return self.cookie
+
+    def WriteTableEntry(self, table_entry, dry_run=False):
+        self.WriteTableEntries([(p4runtime_pb2.Update.INSERT, table_entry)])
+
+    def WriteTableEntries(self, updates, atomicity=None, dry_run=False):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        for update_type, table_entry in updates:
+            key = entry_key(table_entry)
+            exists = key in self.entries
+            if update_type == p4runtime_pb2.Update.DELETE:
+                self.conflicts += not exists
+                self.entries.pop(key, None)
+                continue
+            if exists == (update_type == p4runtime_pb2.Update.INSERT):
+                self.conflicts += 1
+            entry = p4runtime_pb2.TableEntry()
+            entry.CopyFrom(table_entry)
+            self.entries[key] = entry
+        self.write_calls += 1
+        self.updates_written += len(updates)
+        self.last_write_done = time.monotonic()
+
+    def WriteRegisterEntries(self, register_entries, dry_run=False):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        for entry in register_entries:
+            self.registers[(entry.register_id, entry.index.index)] = entry.data.bitstring
+        self.write_calls += 1
+        self.updates_written += len(register_entries)
+        self.last_write_done = time.monotonic()
+
+    def ReadTableEntries(self, table_id=None, dry_run=False):
+        response = p4runtime_pb2.ReadResponse()
+        for entry in self.entries.values():
+            if not table_id or entry.table_id == table_id:
+                response.entities.add().table_entry.CopyFrom(entry)
+        yield response
+
+    def ReadCounters(self, counter_id=None, index=None, dry_run=False):
+        yield p4runtime_pb2.ReadResponse()  # No traffic goes through the fake
+
+    def shutdown(self):
+        pass
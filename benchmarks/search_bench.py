@@ -0,0 +1,109 @@
+"""Per-query latency of the SIFT nearest-neighbour kernels.
+
+Compares the original broadcast kernel (database - query, then einsum), which
+allocates a full database-sized temporary per query, with
+sift/search_engine.py (precomputed norms, one BLAS matrix-vector product into
+a reused buffer), on the real dataset if present or on SIFT-like random data.
+Then micro-batches of B queries (SearchEngine.search_batch, one
+matrix-matrix product) are timed: a batched request's service latency is
+the whole batch's time, plus up to the server's --batch-wait-us while the
+batch fills under light load, in exchange for a lower cost per query.
+
+    python3 benchmarks/search_bench.py --vectors 100000 --queries 200 --batches 1,8,32
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "sift"))
+
+from search_engine import SearchEngine
+
+DATA_FILE = os.path.join(REPO_ROOT, "sift", "sift_data", "dataset.npy")
+QUERY_FILE = os.path.join(REPO_ROOT, "sift", "sift_data", "queries.npy")
+
+
+def broadcast_search(database, query):
+    diff = database - query
+    sq_dists = np.einsum("ij,ij->i", diff, diff)
+    return np.argpartition(sq_dists, 1)[0]
+
+
+def load(vectors, queries, seed):
+    if os.path.exists(DATA_FILE) and os.path.exists(QUERY_FILE):
+        return (np.load(DATA_FILE)[:vectors].astype(np.float32),
+                np.load(QUERY_FILE)[:queries].astype(np.float32))
+    # SIFT descriptors are small non-negative integers
+    rng = np.random.default_rng(seed)
+    return (rng.integers(0, 128, (vectors, 128)).astype(np.float32),
+            rng.integers(0, 128, (queries, 128)).astype(np.float32))
+
+
+def time_queries(search, queries):
+    """Returns (results, per-query latencies in seconds)."""
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(int(search(q)))
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies)
+
+
+def report(name, latencies):
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f"{name:>10} {p50:>10.3f} {p99:>10.3f} {len(latencies) / latencies.sum():>10.1f}")
+
+
+def time_batches(engine, queries, size):
+    """Returns per-batch latencies in seconds for batches of size queries."""
+    engine.search_batch(queries[:size])  # Warm-up: allocates the batch buffer
+    latencies = []
+    for i in range(0, len(queries) - size + 1, size):
+        start = time.perf_counter()
+        engine.search_batch(queries[i:i + size])
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batches", default="1,4,16,64", help="Comma-separated batch sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    database, queries = load(args.vectors, args.queries, args.seed)
+    engine = SearchEngine(database)
+    print(f"{database.shape[0]} vectors x {database.shape[1]} dims, {len(queries)} queries")
+
+    base, base_lat = time_queries(lambda q: broadcast_search(database, q), queries)
+    fast, fast_lat = time_queries(engine.search, queries)
+    # Ties and float32 rounding may pick a different but equally near vector
+    mismatched = sum(
+        1 for q, a, b in zip(queries, base, fast)
+        if a != b and not np.isclose(((database[a] - q) ** 2).sum(), ((database[b] - q) ** 2).sum())
+    )
+
+    print(f"{'kernel':>10} {'p50 ms':>10} {'p99 ms':>10} {'qps':>10}")
+    report("broadcast", base_lat)
+    report("engine", fast_lat)
+    print(f"speedup (median): {np.median(base_lat) / np.median(fast_lat):.1f}x, "
+          f"mismatched answers: {mismatched}")
+
+    print(f"\n{'batch':>10} {'p50 ms':>10} {'p99 ms':>10} {'qps':>10} {'us/query':>10}")
+    for size in map(int, args.batches.split(",")):
+        if size > len(queries):
+            continue
+        latencies = time_batches(engine, queries, size)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        per_query = latencies.sum() / (len(latencies) * size)
+        print(f"{size:>10} {p50:>10.3f} {p99:>10.3f} {1 / per_query:>10.1f} {per_query * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import time
+
+import telemetry_ingest
+from bandit_policies import MAB_GAMMA, ArrayDiscountedUCB, make_policy
+from controller_metrics import METRICS_HOST, METRICS_PORT, ControllerMetrics, GaugeFunc
+from decision_damper import DecisionDamper
+from score_index import BUSY_UTIL, ServerScoreIndex
+
+# Target-independent load-balancer controller: telemetry ingestion, policy,
+# damping and server weights. The switch is reached only through a
+# SwitchBackend (switch_backend.py), so the same core drives BMv2, Tofino
+# or the in-memory model.
+
+ECMP_MODES = ("priority", "weighted")
+PRIORITY_POLICIES = ("energy_aware", "performance_only", "mab")
+# 'agent': trust the score each agent computed from its own throughput;
+# 'switch': rescore every report as switch-counted replies/s per reported watt
+SCORE_SOURCES = ("agent", "switch")
+COUNTER_INTERVAL = 0.5  # Seconds between reads of the switch traffic counters
+SCORE_EPSILON = 1.0     # Same offset server_agent adds to the throughput
+MIN_WEIGHT_SCORE = 1e-6  # Floor before inverting a lower-is-better score into a weight
+
+
+class LBController:
+    def __init__(self, backend, tick_interval=telemetry_ingest.TICK_INTERVAL,
+                 ecmp_mode="priority", policy="energy_aware", higher_score_first=True,
+                 damper=None, metrics_port=METRICS_PORT, mab_policy="d-ucb",
+                 mab_arrays=False, score_source="agent", metrics_host=METRICS_HOST,
+                 listen=True):
+        if ecmp_mode not in ECMP_MODES:
+            raise ValueError(f"ecmp_mode must be one of {ECMP_MODES}")
+        if policy not in PRIORITY_POLICIES:
+            raise ValueError(f"policy must be one of {PRIORITY_POLICIES}")
+        if score_source not in SCORE_SOURCES:
+            raise ValueError(f"score_source must be one of {SCORE_SOURCES}")
+        self.backend = backend
+        self.tick_interval = tick_interval
+        self.ecmp_mode = ecmp_mode
+        self.policy = policy
+        self.higher_score_first = higher_score_first
+        self.score_source = score_source
+        self.unscored = set()  # (host, reason) already warned about
+        # The MAB always ranks higher scores first
+        better_high = higher_score_first or policy == "mab"
+        self.damper = damper or DecisionDamper(higher_is_better=better_high)
+        self.metrics = ControllerMetrics()
+        self.metrics.add(GaugeFunc(
+            "lb_decisions_total", "Policy decisions applied or suppressed", ("outcome",),
+            lambda: [((k,), v) for k, v in self.damper.counters.items()], kind="counter"))
+        if metrics_port is not None:
+            self.metrics.serve(metrics_port, metrics_host)
+        self.server_stats = {}
+        self.score_index = ServerScoreIndex(higher_score_first=higher_score_first)
+        # Switch-measured traffic: last counter totals and derived rates
+        self.counter_totals = None
+        self.counter_stamp = time.monotonic()
+        self.switch_rates = {}  # host -> (requests/s, replies/s, reply bytes/s)
+        self.metrics.add(GaugeFunc(
+            "lb_server_throughput", "Switch-measured traffic per server", ("host", "kind"),
+            self._throughput_samples))
+        self.server_power = {}  # host -> (total watts, ((domain, watts), ...))
+        self.metrics.add(GaugeFunc(
+            "lb_server_power_watts", "Agent-reported power per server and domain",
+            ("host", "domain"), self._power_samples))
+
+        # --- MAB State Variables ---
+        # mab_policy names one of bandit_policies.POLICIES (default D-UCB,
+        # lazily decayed). mab_arrays=True scores a D-UCB pool with NumPy.
+        self.mab = None
+        if policy == "mab":
+            if mab_arrays and mab_policy == "d-ucb":
+                self.mab = ArrayDiscountedUCB(MAB_GAMMA)
+            else:
+                self.mab = make_policy(mab_policy)
+
+        # 1. Connect, load the installed state and install static rules
+        self.backend.start(self.metrics)
+        self.installed_keys = self.backend.installed_ecmp()
+
+        # 2. Install Default Forwarding Rules (a restart keeps the live ones)
+        if not self.installed_keys:
+            defaults = [(h, 0) for h in list(self.backend.server_info)[:2]]
+            print(f"Initializing Default Forwarding Rules {[h for h, _ in defaults]}...")
+            self.update_switch_tables(defaults)
+
+        # 3. Verify
+        print("\n--- VERIFYING SWITCH STATE ---")
+        self.backend.verify()
+        print("------------------------------\n")
+
+        if listen:
+            print("Controller is ready and listening.")
+            self.run_listener()
+
+    def update_switch_tables(self, priority_list, weighted=False):
+        """Returns False if the switch write failed."""
+        print(f"--- Logic Update: New Priority {[x[0] for x in priority_list]} ---")
+
+        # Desired state: the listed servers share the traffic, evenly or in
+        # proportion to how well they rank (the score itself, or its inverse
+        # when lower scores rank first)
+        weights = {}
+        for hostname, score in priority_list:
+            if hostname not in self.backend.server_info:
+                print(f"   > Warning: Unknown hostname '{hostname}' in priority list")
+                continue
+            if not weighted:
+                weights[hostname] = 1.0
+            elif self.higher_score_first:
+                weights[hostname] = score
+            else:
+                weights[hostname] = 1.0 / max(score, MIN_WEIGHT_SCORE)
+        if not weights:
+            return False
+
+        errors = self.backend.write_errors
+        written = self.backend.write_weights(weights)
+        self.installed_keys = self.backend.installed_ecmp()
+        if self.backend.write_errors != errors:
+            return False
+        if written:
+            print(f"   > {written} switch entries rewritten")
+        else:
+            print("Equal! (No change needed)")
+        return True
+
+    def run_listener(self, **kwargs):
+        telemetry_ingest.serve(self, tick_interval=self.tick_interval, **kwargs)
+
+    def on_tick(self):
+        """Turns the switch counters into per-server rates every COUNTER_INTERVAL."""
+        now = time.monotonic()
+        if now - self.counter_stamp < COUNTER_INTERVAL:
+            return
+        try:
+            totals = self.backend.read_counters()
+        except Exception as e:
+            print(f"Error reading switch counters: {e}")
+            return
+        if totals is None:
+            if self.score_source == "switch" and "counters" not in self.unscored:
+                self.unscored.add("counters")
+                print("   > Warning: switch scoring is on but the backend exposes no counters")
+            return
+        elapsed = now - self.counter_stamp
+        previous = self.counter_totals or {}
+        for host, values in totals.items():
+            before = previous.get(host)
+            if before is None:
+                continue
+            # Counters restart from zero when the pipeline is pushed again
+            self.switch_rates[host] = tuple(max(0, v - b) / elapsed for v, b in zip(values, before))
+        self.counter_totals = totals
+        self.counter_stamp = now
+
+    def _throughput_samples(self):
+        samples = []
+        for host, (requests, replies, reply_bytes) in list(self.switch_rates.items()):
+            samples.append(((host, "requests_per_second"), f"{requests:.2f}"))
+            samples.append(((host, "replies_per_second"), f"{replies:.2f}"))
+            samples.append(((host, "reply_bytes_per_second"), f"{reply_bytes:.2f}"))
+        return samples
+
+    def _power_samples(self):
+        samples = []
+        for host, (total, domains) in list(self.server_power.items()):
+            samples.append(((host, "total"), f"{total:.2f}"))
+            for domain, watts in domains:
+                samples.append(((host, domain), f"{watts:.2f}"))
+        return samples
+
+    def ingest_report(self, host, score, util, power=None, domains=()):
+        # power is the whole-server total (all packages and DRAM); domains
+        # only break it down for the metrics
+        if power is not None:
+            self.server_power[host] = (power, domains)
+        # Switch scoring uses delivered replies per second instead of the
+        # throughput the server measured itself; a report it cannot rescore
+        # is dropped rather than ranked by 1/power
+        if self.score_source == "switch":
+            rates = self.switch_rates.get(host)
+            if not power or rates is None:
+                reason = "no power in report" if not power else "no switch counters"
+                if (host, reason) not in self.unscored:
+                    self.unscored.add((host, reason))
+                    print(f"   > Warning: ignoring reports from {host} for switch scoring ({reason})")
+                return
+            score = (rates[1] + SCORE_EPSILON) / power
+        self.server_stats[host] = (score, util)
+        self.score_index.update(host, score, util)
+        if self.mab is not None:
+            self.update_mab_state(host, reward=score)
+        print(f"Received update from {host}: Score={score}, Util={util}%")
+
+    def recompute_and_update(self, N=1):
+        if self.ecmp_mode == "weighted":
+            # Every reporting server gets a share of the slots by efficiency
+            with self.metrics.policy_eval.time():
+                ordered = self.energy_aware_priority(len(self.server_stats))
+            if ordered and self.damper.admit(ordered, weighted=True):
+                self.apply_decision(ordered, weighted=True)
+            return
+        with self.metrics.policy_eval.time():
+            if self.policy == "mab":
+                ordered = self.mab_priority(N)
+            elif self.policy == "performance_only":
+                ordered = self.performance_only_priority(N)
+            else:
+                ordered = self.energy_aware_priority(N)
+        # Hysteresis compares incumbents on the keys the policy ranks by:
+        # energy_aware puts available servers ahead of busy ones, then score
+        tier_of = None
+        if self.policy == "mab":
+            value_of, higher_is_better = self.mab_score, True
+        elif self.policy == "performance_only":
+            value_of, higher_is_better = self.current_util, False
+        else:
+            value_of, higher_is_better = self.current_score, None
+            tier_of = self.current_tier
+        if ordered and self.damper.admit(ordered, value_of=value_of,
+                                         higher_is_better=higher_is_better, tier_of=tier_of):
+            self.apply_decision(ordered)
+
+    def apply_decision(self, ordered, weighted=False):
+        # Dwell and write tokens count only once the switch took the change
+        if self.update_switch_tables(ordered, weighted=weighted):
+            self.damper.commit(ordered, weighted=weighted)
+        else:
+            self.damper.failed()
+
+    def current_score(self, host):
+        stats = self.server_stats.get(host)
+        return stats[0] if stats else None
+
+    def current_util(self, host):
+        stats = self.server_stats.get(host)
+        return stats[1] if stats else None
+
+    def current_tier(self, host):
+        """0 for an available server, 1 for a busy one (see score_index)."""
+        stats = self.server_stats.get(host)
+        return (0 if stats[1] < BUSY_UTIL else 1) if stats else None
+
+    def energy_aware_priority(self, N):
+        return self.score_index.energy_aware_top(N)
+
+    def performance_only_priority(self, N):
+        return self.score_index.performance_top(N)
+
+    def update_mab_state(self, host, reward):
+        """Feeds the new observation to the bandit policy."""
+        self.mab.update(host, reward)
+
+    def mab_score(self, host):
+        """Bandit score of one server (None if it never reported)."""
+        if host not in self.server_stats:
+            return None
+        return self.mab.score(host)
+
+    def mab_priority(self, N):
+        """Ranks all servers with the bandit policy and returns the top N."""
+        # Every reporting server also updated the bandit state
+        ordered = self.mab.top(N)
+        print(f"--- MAB Algorithm Evaluated Priority: {[x[0] for x in ordered]} ---")
+        return ordered
@@ -0,0 +1,178 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus text-format metrics for the load-balancer controllers.
+# Collection is a dict update or a bisect per event, cheap enough to leave on;
+# formatting only happens when /metrics is scraped.
+
+METRICS_PORT = 9200
+METRICS_HOST = "127.0.0.1"  # Local scrapes only; pass "0.0.0.0" to expose it on the network
+REORDER_WINDOW = 64  # Samples a report may trail the last one before it counts as a restart
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class GaugeFunc:
+    """Metric computed at scrape time from fn() -> [(label_values, value)]."""
+
+    def __init__(self, name, help, labelnames, fn, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.fn():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class ControllerMetrics:
+    def __init__(self):
+        self.last_report = {}  # host -> time.monotonic() of its last report
+        self.last_seq = {}     # host -> sequence number of its last report
+        self.telemetry_messages = Counter(
+            "lb_telemetry_messages_total", "Telemetry samples received", ("host",))
+        self.telemetry_lost = Counter(
+            "lb_telemetry_lost_total", "Telemetry samples missing from the sequence", ("host",))
+        self.parse_errors = Counter(
+            "lb_telemetry_parse_errors_total", "Telemetry datagrams that failed to parse")
+        self.table_writes = Counter(
+            "lb_table_writes_total", "Table entries written to or skipped on the switch", ("result",))
+        self.policy_eval = Histogram(
+            "lb_policy_eval_seconds", "Time to evaluate the load-balancing policy")
+        self.switch_write = Histogram(
+            "lb_switch_write_seconds", "Latency of one P4Runtime write call or BFRT batch")
+        self.report_age = GaugeFunc(
+            "lb_host_report_age_seconds", "Seconds since each host last reported", ("host",),
+            self._report_ages)
+        self.metrics = [
+            self.telemetry_messages, self.telemetry_lost, self.parse_errors, self.table_writes,
+            self.policy_eval, self.switch_write, self.report_age,
+        ]
+
+    def observe_report(self, host, seq=None):
+        self.telemetry_messages.inc((host,))
+        self.last_report[host] = time.monotonic()
+        if seq is None:
+            return  # Legacy text reports carry no sequence number
+        last = self.last_seq.get(host)
+        if last is not None:
+            # seq is a wrapping u32. A sample slightly behind the last one
+            # arrived late and is ignored; a larger backwards jump means the
+            # agent restarted its sequence
+            behind = (last - seq) & 0xFFFFFFFF
+            if behind < REORDER_WINDOW:
+                return
+            gap = (seq - last - 1) & 0xFFFFFFFF
+            if gap < 0x80000000 and gap:
+                self.telemetry_lost.inc((host,), gap)
+        self.last_seq[host] = seq
+
+    def add(self, metric):
+        """Registers an extra metric owned by the controller."""
+        self.metrics.append(metric)
+
+    def _report_ages(self):
+        now = time.monotonic()
+        return [((host,), f"{now - t:.3f}") for host, t in list(self.last_report.items())]
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=METRICS_PORT, host=METRICS_HOST):
+        """Serves /metrics from a daemon thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Metrics available on http://{host}:{port}/metrics")
+        return server
@@ -0,0 +1,145 @@
+import time
+
+# Filters policy decisions before they reach the switch. Noisy power readings
+# would otherwise flip the winner on every small score change, costing
+# control-plane writes and moving flows back and forth.
+
+HYSTERESIS = 0.05          # A challenger must beat the incumbent by 5%
+MIN_DWELL = 1.0            # Seconds an assignment stays before it may change
+MAX_WRITES_PER_SEC = 2.0   # Token-bucket refill rate for table updates
+WRITE_BURST = 4            # Token-bucket depth
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def ready(self, n=1, now=None):
+        """Refills the bucket and says whether n tokens are available."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.stamp) * self.rate)
+        self.stamp = now
+        return self.tokens >= n
+
+    def consume(self, n=1, now=None):
+        if self.ready(n, now):
+            self.tokens -= n
+            return True
+        return False
+
+
+class DecisionDamper:
+    """Decides whether a new policy output is worth a switch update.
+
+    A decision passes three gates in order: hysteresis (the change must be
+    significant), dwell (the current assignment must be old enough) and a
+    token bucket on table updates. admit() only checks the gates; the
+    caller reports the switch write's outcome with commit() or failed(),
+    so a failed write neither starts a dwell period nor spends a token.
+    Outcomes are tallied in self.counters.
+    """
+
+    def __init__(self, hysteresis=HYSTERESIS, min_dwell=MIN_DWELL,
+                 max_writes_per_sec=MAX_WRITES_PER_SEC, burst=WRITE_BURST,
+                 higher_is_better=True):
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.higher_is_better = higher_is_better
+        self.bucket = TokenBucket(max_writes_per_sec, burst)
+        self.current = None      # Last applied hosts (list) or weights (dict)
+        self.last_change = None
+        self.counters = {
+            "applied": 0,
+            "unchanged": 0,
+            "suppressed_hysteresis": 0,
+            "suppressed_dwell": 0,
+            "suppressed_rate": 0,
+            "write_failed": 0,
+        }
+
+    def admit(self, ordered, value_of=None, weighted=False, now=None, higher_is_better=None,
+              tier_of=None):
+        """Returns True if ordered [(host, value)] should be written to the switch.
+
+        value_of(host) gives an incumbent's current value on the scale the
+        policy ranks by, and higher_is_better (default: the damper's) its
+        direction; without value_of priority changes skip the hysteresis gate.
+        tier_of(host) gives the tier a policy ranks by before value (lower
+        is better): a change that moves to a better tier needs no margin.
+        """
+        now = time.monotonic() if now is None else now
+        proposal = self._proposal(ordered, weighted)
+        if higher_is_better is None:
+            higher_is_better = self.higher_is_better
+
+        if self.current is not None:
+            if self._unchanged(proposal, weighted):
+                self.counters["unchanged"] += 1
+                return False
+            if not self._significant(proposal, value_of, weighted, higher_is_better, tier_of):
+                self.counters["suppressed_hysteresis"] += 1
+                return False
+            if now - self.last_change < self.min_dwell:
+                self.counters["suppressed_dwell"] += 1
+                return False
+        if not self.bucket.ready(now=now):
+            self.counters["suppressed_rate"] += 1
+            return False
+        return True
+
+    def commit(self, ordered, weighted=False, now=None):
+        """Records an admitted decision whose switch write succeeded."""
+        now = time.monotonic() if now is None else now
+        self.bucket.consume(now=now)
+        self.counters["applied"] += 1
+        self.current = self._proposal(ordered, weighted)
+        self.last_change = now
+
+    def failed(self):
+        """Records an admitted decision whose switch write failed."""
+        self.counters["write_failed"] += 1
+
+    def _proposal(self, ordered, weighted):
+        if weighted:
+            return {host: value for host, value in ordered}
+        return [host for host, _ in ordered]
+
+    def _unchanged(self, proposal, weighted):
+        if weighted:
+            return proposal == self.current
+        return set(proposal) == set(self.current)
+
+    def _beats(self, new, old, higher_is_better):
+        margin = self.hysteresis * abs(old)
+        if higher_is_better:
+            return new > old + margin
+        return new < old - margin
+
+    def _significant(self, proposal, value_of, weighted, higher_is_better, tier_of=None):
+        if weighted:
+            if proposal.keys() != self.current.keys():
+                return True
+            return any(
+                abs(w - self.current[h]) > self.hysteresis * abs(self.current[h])
+                for h, w in proposal.items()
+            )
+
+        if value_of is None:
+            return True
+        if tier_of is not None:
+            new_tiers = [tier_of(h) for h in proposal if h not in self.current]
+            old_tiers = [tier_of(h) for h in self.current if h not in proposal]
+            if None in new_tiers or None in old_tiers:
+                return True
+            if new_tiers and old_tiers and max(new_tiers) < min(old_tiers):
+                return True  # Every newcomer sits in a better tier than every displaced host
+        newcomers = [value_of(h) for h in proposal if h not in self.current]
+        newcomers = [v for v in newcomers if v is not None]
+        displaced = [value_of(h) for h in self.current if h not in proposal]
+        if not newcomers or not displaced or any(v is None for v in displaced):
+            return True
+        pick_weakest, pick_strongest = (min, max) if higher_is_better else (max, min)
+        return self._beats(pick_weakest(newcomers), pick_strongest(displaced), higher_is_better)
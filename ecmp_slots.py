@@ -0,0 +1,60 @@
+import math
+
+# Slot assignment for the ecmp_nhop table. The data plane hashes every flow
+# onto one of ECMP_SLOTS slots, so a server's traffic share is the fraction
+# of slots it owns. Reassignments keep every slot they can, so most flows
+# stay on their backend when the weights move.
+
+ECMP_SLOTS = 64  # Must match ECMP_SLOTS / ecmp_nhop size in p4src-p4/load_balance.p4
+
+
+def apportion(weights, num_slots=ECMP_SLOTS):
+    """Splits num_slots across hosts proportionally to weights (largest remainder).
+
+    Negative or non-finite weights count as zero; if nothing is left, the
+    slots are split evenly. Returns {host: slot_count}.
+    """
+    if not weights:
+        return {}
+    clipped = {}
+    for host, w in weights.items():
+        w = float(w)
+        clipped[host] = w if math.isfinite(w) and w > 0 else 0.0
+    total = sum(clipped.values())
+    if total <= 0:
+        clipped = dict.fromkeys(clipped, 1.0)
+        total = float(len(clipped))
+
+    quotas = {host: num_slots * w / total for host, w in clipped.items()}
+    counts = {host: int(q) for host, q in quotas.items()}
+    remaining = num_slots - sum(counts.values())
+    by_remainder = sorted(quotas, key=lambda h: (counts[h] - quotas[h], h))
+    for host in by_remainder[:remaining]:
+        counts[host] += 1
+    return counts
+
+
+def assign_slots(current, weights, num_slots=ECMP_SLOTS):
+    """Returns {slot: host} matching apportion(weights) with minimal churn.
+
+    current is the installed {slot: host} map. A slot keeps its host while
+    that host is still under its new quota; only the remaining slots move.
+    """
+    counts = apportion(weights, num_slots)
+    if not counts:
+        return {}
+    assignment = {}
+    kept = dict.fromkeys(counts, 0)
+    free = []
+    for slot in range(num_slots):
+        host = current.get(slot)
+        if host in counts and kept[host] < counts[host]:
+            assignment[slot] = host
+            kept[host] += 1
+        else:
+            free.append(slot)
+
+    deficit = [host for host in sorted(counts) for _ in range(counts[host] - kept[host])]
+    for slot, host in zip(free, deficit):
+        assignment[slot] = host
+    return assignment
@@ -1,75 +1,188 @@
-import socket
+import argparse
+import hashlib
+import os
 import sys
 
+import telemetry_ingest
+from controller_core import ECMP_MODES, SCORE_SOURCES, LBController
+from controller_metrics import METRICS_HOST, METRICS_PORT
+from switch_backend import SwitchBackend
 
-# This path contains the 'p4' folder and 'p4runtime_lib'
-P4_UTILS_PATH = '/home/p4/tutorials/utils'
+
+# The repo's copy of the tutorial utils: its p4runtime_lib carries the
+# batched SwitchConnection writes (WriteTableEntries, WriteRegisterEntries,
+# GetForwardingPipelineCookie) this controller needs, so it goes ahead of
+# any tutorials checkout on sys.path
+P4_UTILS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "p4-utils")
 if P4_UTILS_PATH not in sys.path:
-    sys.path.append(P4_UTILS_PATH)
+    sys.path.insert(0, P4_UTILS_PATH)
 
 try:
-    import p4runtime_lib
     import p4runtime_lib.bmv2 as bmv2
+    import p4runtime_lib.error_utils as error_utils
     import p4runtime_lib.helper as helper
     from p4.v1 import p4runtime_pb2 as p4runtime_pb2
+    from p4runtime_lib.convert import encodeIPv4
     print("--- SUCCESS: P4 Libraries and Protobufs Loaded ---")
 except ImportError as e:
     print(f"--- ERROR: Could not find P4 modules: {e} ---")
     sys.exit(1)
 
+# Repo modules stay outside the guard so their own errors surface as is
+from table_shadow import TableShadow, canonical_bytes  # noqa: E402  (needs the P4 protobufs)
+from weighted_select import assign_indices, cumulative_bounds  # noqa: E402
+
 
 BUILD_DIR = "build"
 JSON_FILE = f"{BUILD_DIR}/load_balance.json"
 P4INFO_FILE = f"{BUILD_DIR}/load_balance.p4.p4info.txtpb"
 GRPC_PORT = 50051 
+OWNED_TABLES = ["MyEgress.send_frame", "MyIngress.server_src_nat", "MyIngress.ecmp_nhop"]
+
+SERVER_INFO = {
+    "h2": {"ip": "10.0.2.2", "mac": "08:00:00:00:02:02", "port": 2},
+    "h3": {"ip": "10.0.3.3", "mac": "08:00:00:00:03:03", "port": 3},
+}
+
+class Bmv2Backend(SwitchBackend):
+    """SwitchBackend for BMv2 over P4Runtime, writing through a TableShadow.
+
+    ecmp_nhop maps backend indices to servers; traffic shares live in the
+    cum_weight register (see weighted_select.py).
+    """
+
+    server_info = SERVER_INFO
 
-class MyLBController:
-    def __init__(self, p4info_path, bmv2_json_path):
+    def __init__(self, p4info_path, bmv2_json_path, switch_conn=None):
         self.p4info_helper = helper.P4InfoHelper(p4info_path)
         self.bmv2_json_path = bmv2_json_path
-        self.server_stats = {} 
-        self.current_allocations = {}
-        self.installed_keys = {}
+        self.switch_conn = switch_conn
+        self.installed_keys = {}  # backend index -> hostname
+        self.weight_bounds = None  # Last cum_weight contents written (None: unknown)
 
-        self.s1_conn = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+    def start(self, metrics):
+        self.metrics = metrics
+        # Stable per-server index into the server_requests/server_replies counters
+        self.server_ids = {host: i for i, host in enumerate(SERVER_INFO)}
+        # switch_conn lets tests and benchmarks inject a fake switch
+        self.s1_conn = self.switch_conn or bmv2.Bmv2SwitchConnection(
             name='s1',
-            address=f'127.0.0.1:{50051}',
+            address=f'127.0.0.1:{GRPC_PORT}',
             device_id=0
         )
         self.s1_conn.MasterArbitrationUpdate()
-        
-        self.s1_conn.SetForwardingPipelineConfig(
-            p4info=self.p4info_helper.p4info,
-            bmv2_json_file_path=JSON_FILE
+
+        # A restarted controller keeps the running pipeline and its tables
+        cookie = self.pipeline_cookie()
+        if self.installed_pipeline_cookie() == cookie:
+            print("--- Switch already runs this pipeline, keeping its tables ---\n")
+        else:
+            self.s1_conn.SetForwardingPipelineConfig(
+                p4info=self.p4info_helper.p4info,
+                bmv2_json_file_path=self.bmv2_json_path,
+                cookie=cookie
+            )
+            print("--- Switch Programmed Successfully ---\n")
+
+        # Load the shadow of every table we own
+        self.ecmp_table_id = self.p4info_helper.get_tables_id("MyIngress.ecmp_nhop")
+        self.shadow = TableShadow(
+            self.p4info_helper.get_tables_id(name) for name in OWNED_TABLES
         )
-        print("--- Switch Programmed Successfully ---\n")
+        self.reconcile()
 
-        # 2. Install Static Rules
+        # Install Static Rules
         self.install_egress_rewrite_rules()
         self.install_return_path_rule()
-        
-        # 3. Install Default Forwarding Rules
-        print("Initializing Default Forwarding Rules (h2, h3)...")
-        default_servers = [("h2", 0), ("h3", 0)] 
-        self.update_switch_tables(default_servers)
 
-        # 4. Verify
-        self.verify_table_state()
+    def installed_ecmp(self):
+        return dict(self.installed_keys)
+
+    def pipeline_cookie(self):
+        """Identifies this p4info + BMv2 JSON pair on the switch."""
+        digest = hashlib.sha256(self.p4info_helper.p4info.SerializeToString(deterministic=True))
+        with open(self.bmv2_json_path, "rb") as f:
+            digest.update(f.read())
+        return int.from_bytes(digest.digest()[:8], "big")
 
-        print("Controller is ready and listening.")
-        self.run_listener()
+    def installed_pipeline_cookie(self):
+        try:
+            return self.s1_conn.GetForwardingPipelineCookie()
+        except Exception:
+            return None  # No pipeline yet
 
     def set_forwarding_pipeline(self):
         print("--- Setting Forwarding Pipeline Config ---")
         try:
             self.s1_conn.SetForwardingPipelineConfig(
                 p4info=self.p4info_helper.p4info,
-                bmv2_json_file_path=self.bmv2_json_path
+                bmv2_json_file_path=self.bmv2_json_path,
+                cookie=self.pipeline_cookie()
             )
             print("   > Pipeline Configured Successfully.")
         except Exception as e:
             print(f"   > Error setting pipeline: {e}")
             # We don't exit here because sometimes it succeeds despite errors if identical
+        self.reconcile()
+
+    def reconcile(self):
+        """Reloads the shadow and installed_keys with one wildcard read."""
+        try:
+            self.shadow.load(self.s1_conn.ReadTableEntries())
+        except Exception as e:
+            print(f"   > Error reading switch state: {e}")
+            return
+        self.installed_keys = self.shadow_ecmp_assignment()
+        print(f"   > Shadow loaded: {len(self.shadow.entries)} entries, "
+              f"{len(self.installed_keys)} ECMP slots")
+
+    def shadow_ecmp_assignment(self):
+        """Decodes the shadowed ecmp_nhop entries into {backend index: hostname}."""
+        action_id = self.p4info_helper.get_actions_id("MyIngress.forward_to_server")
+        ip_param = self.p4info_helper.get_action_param_id("MyIngress.forward_to_server", "server_ip")
+        ip_to_host = {
+            canonical_bytes(encodeIPv4(info["ip"])): host for host, info in SERVER_INFO.items()
+        }
+        assignment = {}
+        for entry in self.shadow.entries_of(self.ecmp_table_id):
+            action = entry.action.action
+            if action.action_id != action_id: continue
+            for param in action.params:
+                host = ip_to_host.get(canonical_bytes(param.value))
+                if param.param_id == ip_param and host:
+                    slot = int.from_bytes(entry.match[0].exact.value, "big")
+                    assignment[slot] = host
+        return assignment
+
+    def sync_entries(self, entries, prune_table_ids=()):
+        """Writes the entries that differ from the shadow in one batch.
+
+        Returns the (update_type, entry) pairs the switch accepted.
+        """
+        updates = self.shadow.plan(entries, prune_table_ids)
+        writes = sum(1 for t, _ in updates if t != p4runtime_pb2.Update.DELETE)
+        self.metrics.table_writes.inc(("skipped",), len(entries) - writes)
+        if not updates: return []
+
+        self.metrics.table_writes.inc(("issued",), len(updates))
+        failed = set()
+        try:
+            with self.metrics.switch_write.time():
+                self.s1_conn.WriteTableEntries(updates)
+        except Exception as e:
+            print(f"!!! CRITICAL ERROR writing batch ({len(updates)} updates) !!!")
+            print(f"    WRITE Error: {e}")
+            self.write_errors += 1
+            failed = self.failed_batch_indices(e, len(updates))
+            if len(failed) == len(updates):
+                # Switch restarted or connection lost: trust nothing we cached
+                self.reconcile()
+                return []
+
+        applied = [u for i, u in enumerate(updates) if i not in failed]
+        for update_type, entry in applied:
+            self.shadow.commit(update_type, entry)
+        return applied
 
     def install_egress_rewrite_rules(self):
         print("Installing Egress Rewrite Rules...")
@@ -78,103 +191,137 @@ class MyLBController:
             2: "00:00:00:00:02:02",
             3: "00:00:00:00:03:03"
         }
-        for port, smac in port_mac_map.items():
-            entry = self.p4info_helper.buildTableEntry(
+        entries = [
+            self.p4info_helper.buildTableEntry(
                 table_name="MyEgress.send_frame",
                 match_fields={"standard_metadata.egress_port": port},
                 action_name="MyEgress.rewrite_mac",
                 action_params={"smac": smac}
             )
-            try:
-                self.s1_conn.WriteTableEntry(entry)
-                print(f"   > Egress Rule: Port {port} -> SMAC {smac}")
-            except Exception as e:
-                if "ALREADY_EXISTS" not in str(e):
-                    print(f"   > Error installing egress rule: {e}")
+            for port, smac in port_mac_map.items()
+        ]
+        applied = self.sync_entries(entries)
+        print(f"   > Egress Rules: {len(applied)} written, {len(entries) - len(applied)} already in place")
 
     def install_return_path_rule(self):
         print("Installing Fixed Return Path Rules (Server IP -> Client IP)...")
         client_ip = "10.0.1.1"
         client_port = 1
         client_mac = "08:00:00:00:01:01"
-        servers = ["10.0.2.2", "10.0.3.3"]
-
-        for server_ip in servers:
-            entry = self.p4info_helper.buildTableEntry(
+        entries = [
+            self.p4info_helper.buildTableEntry(
                 table_name="MyIngress.server_src_nat",
                 match_fields={
-                    "hdr.ipv4.srcAddr": server_ip,
+                    "hdr.ipv4.srcAddr": info["ip"],
                     "hdr.ipv4.dstAddr": client_ip
                 },
                 action_name="MyIngress.nat_reply_to_client",
                 action_params={
                     "client_mac": client_mac, 
-                    "port": client_port
+                    "port": client_port,
+                    "server_id": self.server_ids[host],
                 }
             )
-            try:
-                self.s1_conn.WriteTableEntry(entry)
-                print(f"   > Return Rule: Src {server_ip} -> Dst {client_ip}")
-            except Exception as e:
-                 if "ALREADY_EXISTS" not in str(e):
-                    print(f"   > Error installing return rule: {e}")
+            for host, info in SERVER_INFO.items()
+        ]
+        applied = self.sync_entries(entries)
+        print(f"   > Return Rules: {len(applied)} written, {len(entries) - len(applied)} already in place")
 
-    def update_switch_tables(self, priority_list):
-        server_info = {
-            "h2": {"ip": "10.0.2.2", "mac": "08:00:00:00:02:02", "port": 2},
-            "h3": {"ip": "10.0.3.3", "mac": "08:00:00:00:03:03", "port": 3},
-        }
-        
-        print(f"--- Logic Update: New Priority {[x[0] for x in priority_list]} ---")
+    def ecmp_entry(self, index, hostname):
+        info = SERVER_INFO[hostname]
+        return self.p4info_helper.buildTableEntry(
+            table_name="MyIngress.ecmp_nhop",
+            match_fields={"meta.ecmp_select": index},
+            action_name="MyIngress.forward_to_server",
+            action_params={
+                "server_mac": info["mac"],
+                "server_ip": info["ip"],
+                "port": info["port"],
+                "server_id": self.server_ids[hostname],
+            },
+        )
 
-        desired_keys = set()
+    def write_ecmp(self, assignment):
+        entries = [self.ecmp_entry(index, hostname) for index, hostname in assignment.items()]
 
-        for index, server_tuple in enumerate(priority_list):
-            hostname = server_tuple[0]
-            if hostname not in server_info: continue
-            info = server_info[hostname]
-            desired_keys.add(index)
+        # One WriteRequest for the whole change; matching slots are skipped
+        applied = self.sync_entries(entries, prune_table_ids={self.ecmp_table_id})
+        self.installed_keys = self.shadow_ecmp_assignment()
+        return len(applied)
 
-            new_entry = self.p4info_helper.buildTableEntry(
-                table_name="MyIngress.ecmp_nhop",
-                match_fields={"meta.ecmp_select": index},
-                action_name="MyIngress.forward_to_server",
-                action_params={
-                    "server_mac": info["mac"],      
-                    "server_ip": info["ip"],    
-                    "port": info["port"],
-                },
-            )
+    def write_weights(self, weights):
+        # Servers keep their backend index, so ecmp_nhop only changes when one
+        # joins or, with every index taken, displaces a lighter server;
+        # entries of departed servers stay (at zero weight) until their
+        # index is reused, so no flow is ever pointed at a missing entry.
+        indices = assign_indices(self.installed_keys, weights)
+        for host in weights:
+            if host not in indices.values():
+                print(f"   > Warning: no backend index left for '{host}'")
+        entries = [self.ecmp_entry(index, hostname) for index, hostname in indices.items()]
+        written = len(self.sync_entries(entries))
+        self.installed_keys = self.shadow_ecmp_assignment()
 
-            current = self.installed_keys.get(index)
-            print("Current is:" + str(current))
-            
-            try:
-                if current == hostname:
-                    print("Equal!")
-                    continue
-                elif current is not None:
-                    print("Change")
-                    request = p4runtime_pb2.WriteRequest()
-                    request.device_id = self.s1_conn.device_id
-                    request.election_id.low = 1
-
-                    update = request.updates.add()
-                    update.type = p4runtime_pb2.Update.MODIFY
-                    update.entity.table_entry.CopyFrom(new_entry)
-                    self.s1_conn.client_stub.Write(request)
-                else:                
-                    print("Write")
-                    self.s1_conn.WriteTableEntry(new_entry)
-                    print(f"   > Index {index}: Inserted {hostname}")
-
-                self.installed_keys[index]=hostname
-            except Exception as e_insert:
-                print(f"!!! CRITICAL ERROR writing Index {index} !!!")
-                print(f"    INSERT Error: {e_insert}")
-
-    def verify_table_state(self):
-        print("\n--- VERIFYING SWITCH STATE ---")
+        # Only weight indices whose entry the switch now holds: a newcomer
+        # whose ecmp_nhop write failed keeps zero share until it lands
+        live = {i: weights[h] for i, h in indices.items() if self.installed_keys.get(i) == h}
+        for i, host in indices.items():
+            if i not in live:
+                print(f"   > Warning: no ecmp_nhop entry for '{host}', leaving it unweighted")
+        if not any(live.values()):
+            return written
+        bounds = cumulative_bounds(live)
+        cells = [
+            self.p4info_helper.buildRegisterEntry("MyIngress.cum_weight", i, bound)
+            for i, bound in enumerate(bounds)
+            if self.weight_bounds is None or self.weight_bounds[i] != bound
+        ]
+        self.metrics.table_writes.inc(("skipped",), len(bounds) - len(cells))
+        if not cells:
+            return written
+        self.metrics.table_writes.inc(("issued",), len(cells))
+        try:
+            with self.metrics.switch_write.time():
+                self.s1_conn.WriteRegisterEntries(cells)
+        except Exception as e:
+            print(f"!!! CRITICAL ERROR writing cum_weight: {e}")
+            self.write_errors += 1
+            self.weight_bounds = None  # Rewrite every cell next time
+            return written
+        self.weight_bounds = bounds
+        return written + len(cells)
+
+    def failed_batch_indices(self, error, batch_size):
+        """Returns the batch positions that failed; all of them if the error has no details."""
+        try:
+            p4_errors = error_utils.parseGrpcErrorBinaryDetails(error)
+        except error_utils.P4RuntimeErrorFormatException:
+            p4_errors = None
+        if p4_errors is None:
+            return set(range(batch_size))
+        return {idx for idx, _ in p4_errors}
+
+    def read_counters(self):
+        totals = {host: [0, 0, 0] for host in self.server_ids}
+        host_of = {i: host for host, i in self.server_ids.items()}
+        for name, replies in (("MyIngress.server_requests", False),
+                              ("MyIngress.server_replies", True)):
+            counter_id = self.p4info_helper.get_counters_id(name)
+            # One wildcard read returns every cell of the counter array
+            for response in self.s1_conn.ReadCounters(counter_id):
+                for entity in response.entities:
+                    entry = entity.counter_entry
+                    host = host_of.get(entry.index.index)
+                    if host is None:
+                        continue
+                    if replies:
+                        totals[host][1] = entry.data.packet_count
+                        totals[host][2] = entry.data.byte_count
+                    else:
+                        totals[host][0] = entry.data.packet_count
+        return {host: tuple(v) for host, v in totals.items()}
+
+    def verify(self):
         tables = ["MyIngress.ecmp_nhop", "MyIngress.server_src_nat"]
         for table_name in tables:
             try:
@@ -189,47 +336,33 @@ class MyLBController:
                     print(f"  [OK] Table {table_name} has {count} entries.")
             except Exception as e:
                 print(f"  [ERROR] Failed to read {table_name}: {e}")
-        print("------------------------------\n")
-
-    def run_listener(self):
-        print("Starting UDP Listener on Port 50001...")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(("0.0.0.0", 50001))
-        
-        while True:
-            data, addr = sock.recvfrom(1024)
-            try:
-                msg = data.decode().strip()
-                host, score, util = msg.split(",")
-                self.server_stats[host] = (float(score), float(util))
-                print(f"Received update from {host}: Score={score}, Util={util}%")
-                self.recompute_and_update()
-            except Exception as e:
-                print(f"Error parsing message: {e}")
-
-    def recompute_and_update(self, N=1):
-        # ordered = self.performance_only_priority(N)
-        ordered = self.energy_aware_priority(N)
-        if ordered: self.update_switch_tables(ordered)
-
-    def energy_aware_priority(self, N):
-        available = []
-        busy = []
-        for host, (score, util) in self.server_stats.items():
-            if util < 70.0: available.append((host, score))
-            else: busy.append((host, score))
-        available.sort(key=lambda x: x[1], reverse=False)
-        busy.sort(key=lambda x: x[1], reverse=False)
-        ordered = (available + busy)[:N]
-        return ordered
-    
-    def performance_only_priority(self, N):
-        allServers = []
-        for host, (score, util) in self.server_stats.items():
-            allServers.append((host, util))
-        allServers.sort(key=lambda x: x[1], reverse=False)
-        ordered = (allServers)[:N]
-        return ordered
+
+
+class MyLBController(LBController):
+    """Energy-aware controller for the BMv2 switch."""
+
+    def __init__(self, p4info_path, bmv2_json_path, tick_interval=telemetry_ingest.TICK_INTERVAL,
+                 ecmp_mode="priority", damper=None, metrics_port=METRICS_PORT,
+                 switch_conn=None, score_source="agent", metrics_host=METRICS_HOST,
+                 listen=True):
+        # energy_aware_priority ranks lower scores first
+        super().__init__(
+            Bmv2Backend(p4info_path, bmv2_json_path, switch_conn),
+            tick_interval=tick_interval, ecmp_mode=ecmp_mode, policy="energy_aware",
+            higher_score_first=False, damper=damper, metrics_port=metrics_port,
+            score_source=score_source, metrics_host=metrics_host, listen=listen,
+        )
+
 
 if __name__ == "__main__":
-    ctrl = MyLBController("build/load_balance.p4.p4info.txtpb", "build/load_balance.json")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Energy-aware controller for the BMv2 switch")
+    parser.add_argument("--ecmp-mode", choices=ECMP_MODES, default="priority",
+                        help="'priority': top server(s) only; 'weighted': share by efficiency")
+    parser.add_argument("--score-source", choices=SCORE_SOURCES, default="agent",
+                        help="'agent': agents' own scores; 'switch': switch-counted replies/s "
+                             "per reported watt (agents run --throughput-source switch)")
+    parser.add_argument("--metrics-host", default=METRICS_HOST,
+                        help="Bind address of the /metrics endpoint")
+    args = parser.parse_args()
+    ctrl = MyLBController(P4INFO_FILE, JSON_FILE, ecmp_mode=args.ecmp_mode,
+                          score_source=args.score_source, metrics_host=args.metrics_host)
\ No newline at end of file
@@ -1,58 +1,176 @@
+import argparse
 import socket
-import math
+
 import bfrt_grpc.client as gc
 
+import telemetry_ingest
+from bandit_policies import POLICIES
+from controller_core import ECMP_MODES, SCORE_SOURCES, LBController
+from controller_metrics import METRICS_HOST, METRICS_PORT
+from switch_backend import SwitchBackend
 
-class MyLBController:
-    def __init__(self, program_name="load_balance", grpc_addr="127.0.0.1:50052"):
-        self.server_stats = {}
-        self.current_allocations = {}
-        self.installed_keys = {}
+# PHYSICAL TOPOLOGY MAPPING
+SERVER_INFO = {
+    "h2": {"ip": "10.0.1.1", "mac": "94:6d:ae:5c:87:72", "port": 132},  # 100G Port
+    "h3": {"ip": "10.0.1.2", "mac": "94:6d:ae:5d:fd:9c", "port": 180},  # 10G Port
+}
+
+
+def bfrt_canonical(value):
+    """Hashable integer form of a BFRT field value (int, bytes, MAC or IPv4 string)."""
+    if isinstance(value, (bytes, bytearray)):
+        return int.from_bytes(value, "big")
+    if isinstance(value, str):
+        if ":" in value:
+            return int(value.replace(":", ""), 16)
+        if "." in value:
+            return int.from_bytes(socket.inet_aton(value), "big")
+        return int(value, 0)
+    return int(value)
 
-        # --- MAB (D-UCB) State Variables ---
-        self.mab_gamma = 0.95        # Decay factor (closer to 1 = longer memory)
-        self.mab_counts = {}         # Tracks decayed 'pulls' per server
-        self.mab_values = {}         # Tracks decayed reward per server
-        self.mab_total_pulls = 0     # Total observations
-        # -----------------------------------
 
+class TofinoBackend(SwitchBackend):
+    """SwitchBackend for Tofino over BFRT, batching writes per table."""
+
+    server_info = SERVER_INFO
+
+    def __init__(self, program_name="load_balance", grpc_addr="127.0.0.1:50052"):
+        self.program_name = program_name
+        self.grpc_addr = grpc_addr
+        self.installed = {}       # table -> {key fields: (action, data fields)}
+        self.installed_keys = {}  # ECMP slot -> hostname
+
+    def start(self, metrics):
+        self.metrics = metrics
         print("--- Initializing BFRT Connection ---")
         self.client_id = 0
         self.device_id = 0
 
         # 1. Connect and Bind to Tofino
         self.bfrt_interface = gc.ClientInterface(
-            grpc_addr, self.client_id, self.device_id
+            self.grpc_addr, self.client_id, self.device_id
         )
-        self.bfrt_interface.bind_pipeline_config(program_name)
-        self.bfrt_info = self.bfrt_interface.bfrt_info_get(program_name)
+        self.bfrt_interface.bind_pipeline_config(self.program_name)
+        self.bfrt_info = self.bfrt_interface.bfrt_info_get(self.program_name)
         self.target = gc.Target(device_id=self.device_id, pipe_id=0xFFFF)
 
         # Retrieve table objects (Note: Tofino prepends 'pipe.' to block names)
         self.egress_table = self.bfrt_info.table_get("pipe.SwitchEgress.send_frame")
         self.nat_table = self.bfrt_info.table_get("pipe.SwitchIngress.server_src_nat")
         self.ecmp_table = self.bfrt_info.table_get("pipe.SwitchIngress.ecmp_nhop")
+        self.request_counter = self.bfrt_info.table_get("pipe.SwitchIngress.server_requests")
+        self.reply_counter = self.bfrt_info.table_get("pipe.SwitchIngress.server_replies")
+        # Stable per-server index into the server_requests/server_replies counters
+        self.server_ids = {host: i for i, host in enumerate(SERVER_INFO)}
 
         print("--- Switch Programmed Successfully ---\n")
 
+        # Cache what is already installed so writes only carry real changes
+        for table in (self.egress_table, self.nat_table, self.ecmp_table):
+            self.reconcile_table(table)
+
         # 2. Install Static Rules
         self.install_egress_rewrite_rules()
         self.install_return_path_rule()
 
-        # 3. Install Default Forwarding Rules
-        print("Initializing Default Forwarding Rules (h2, h3)...")
-        default_servers = [("h2", 0), ("h3", 0)]
-        self.update_switch_tables(default_servers)
-
-        # 4. Verify
-        self.verify_table_state()
-
-        print("Controller is ready and listening.")
-        self.run_listener()
-
-    def mac_to_bytes(self, mac_str):
-        """Helper to convert MAC strings to bytearrays for BFRT."""
-        return bytearray.fromhex(mac_str.replace(":", ""))
+    def installed_ecmp(self):
+        return dict(self.installed_keys)
+
+    def reconcile_table(self, table):
+        """Reloads the cached view of one table with a single wildcard read."""
+        cache = {}
+        try:
+            for data, key in table.entry_get(self.target, [], {"from_hw": False}):
+                key_fields = tuple(sorted(
+                    (name, bfrt_canonical(field["value"])) for name, field in key.to_dict().items()
+                ))
+                cache[key_fields] = self.read_signature(data)
+        except Exception as e:
+            print(f"   > Error reading {table.info.name_get()}: {e}")
+        self.installed[table] = cache
+        if table is self.ecmp_table:
+            self.installed_keys = self.cached_ecmp_assignment()
+
+    def read_signature(self, data):
+        """(action, data fields) of a read-back entry; None if it cannot be decoded."""
+        try:
+            fields = data.to_dict()
+            action = fields.pop("action_name", None)
+            fields.pop("is_default_entry", None)
+            return (action, tuple(sorted((n, bfrt_canonical(v)) for n, v in fields.items())))
+        except (TypeError, ValueError):
+            return None
+
+    def cached_ecmp_assignment(self):
+        """Decodes the cached ecmp_nhop entries into {slot: hostname}."""
+        ip_to_host = {bfrt_canonical(info["ip"]): host for host, info in SERVER_INFO.items()}
+        assignment = {}
+        for key_fields, signature in self.installed[self.ecmp_table].items():
+            server_ip = dict(signature[1]).get("server_ip") if signature else None
+            assignment[dict(key_fields)["meta.ecmp_select"]] = ip_to_host.get(server_ip)
+        return assignment
+
+    def sync_table(self, table, desired, prune=False):
+        """Brings one table to desired = {key_fields: (action, data_fields)}.
+
+        Keys missing from the cached view are added and changed ones modified,
+        each kind as a single multi-entry call; with prune, cached keys not in
+        desired are deleted. All calls go out in one BFRT batch. Returns the
+        keys whose entries changed.
+        """
+        cache = self.installed.setdefault(table, {})
+        adds, mods = [], []
+        for key_fields, signature in desired.items():
+            if key_fields not in cache:
+                adds.append(key_fields)
+            elif cache[key_fields] != signature:
+                mods.append(key_fields)
+            else:
+                self.metrics.table_writes.inc(("skipped",))
+        dels = [k for k in cache if k not in desired] if prune else []
+        if not (adds or mods or dels):
+            return []
+
+        def keys_of(batch):
+            return [table.make_key([gc.KeyTuple(n, v) for n, v in k]) for k in batch]
+
+        def data_of(batch):
+            return [
+                table.make_data([gc.DataTuple(n, v) for n, v in desired[k][1]],
+                                desired[k][0])
+                for k in batch
+            ]
+
+        add_keys, add_data = keys_of(adds), data_of(adds)
+        mod_keys, mod_data = keys_of(mods), data_of(mods)
+        del_keys = keys_of(dels)
+        try:
+            # entry_* calls only buffer inside a batch; the RPC goes out at
+            # batch_end, so the whole block is one switch write
+            with self.metrics.switch_write.time():
+                self.bfrt_interface.batch_begin()
+                try:
+                    if adds:
+                        table.entry_add(self.target, add_keys, add_data)
+                    if mods:
+                        table.entry_mod(self.target, mod_keys, mod_data)
+                    if dels:
+                        table.entry_del(self.target, del_keys)
+                finally:
+                    self.bfrt_interface.batch_end()
+        except Exception as e:
+            # Part of the batch may have landed: trust the switch, not the plan
+            print(f"!!! CRITICAL ERROR writing {table.info.name_get()}: {e}")
+            self.write_errors += 1
+            self.reconcile_table(table)
+            return []
+
+        self.metrics.table_writes.inc(("issued",), len(adds) + len(mods) + len(dels))
+        for key_fields in adds + mods:
+            cache[key_fields] = desired[key_fields]
+        for key_fields in dels:
+            del cache[key_fields]
+        return adds + mods + dels
 
     def install_egress_rewrite_rules(self):
         print("Installing Egress Rewrite Rules (Source MAC Rewriting)...")
@@ -65,107 +183,73 @@ class MyLBController:
             132: "00:00:00:00:02:02", 
             180: "00:00:00:00:03:03", 
         }
+        desired = {}
         for port, smac in port_mac_map.items():
-            key = self.egress_table.make_key(
-                [gc.KeyTuple("eg_intr_md.egress_port", port)]
-            )
-            data = self.egress_table.make_data(
-                [gc.DataTuple("smac", self.mac_to_bytes(smac))],
-                "SwitchEgress.rewrite_mac",
+            desired[(("eg_intr_md.egress_port", port),)] = (
+                "SwitchEgress.rewrite_mac", (("smac", bfrt_canonical(smac)),)
             )
-
-            try:
-                # Use entry_add; if it fails, the verify step will catch it
-                self.egress_table.entry_add(self.target, [key], [data])
-                print(f"   > Egress Rule: Port {port} -> SMAC {smac}")
-            except Exception as e:
-                if "ALREADY_EXISTS" in str(e):
-                    self.egress_table.entry_mod(self.target, [key], [data])
-                else:
-                    print(f"   > Error on Port {port}: {e}")
+        for key_fields in self.sync_table(self.egress_table, desired):
+            print(f"   > Egress Rule: Port {key_fields[0][1]} -> SMAC {port_mac_map[key_fields[0][1]]}")
 
     def install_return_path_rule(self):
         print("Installing Fixed Return Path Rules (Server -> Client)...")
         client_ip = "10.0.3.3"
         client_port = 40  # Based on your UP port 33/0
         client_mac = "94:6d:ae:5c:86:b2"
-        
-        # Real Backend Server IPs from p4server1 and p4server3
-        servers = ["10.0.1.2", "10.0.1.1"]
-
-        for server_ip in servers:
-            key = self.nat_table.make_key([
-                gc.KeyTuple("hdr.ipv4.srcAddr", self.ipv4_to_bytes(server_ip)),
-                gc.KeyTuple("hdr.ipv4.dstAddr", self.ipv4_to_bytes(client_ip)),
-            ])
-            data = self.nat_table.make_data([
-                gc.DataTuple("client_mac", self.mac_to_bytes(client_mac)),
-                gc.DataTuple("port", client_port),
-            ], "SwitchIngress.nat_reply_to_client")
 
-            try:
-                self.nat_table.entry_add(self.target, [key], [data])
-                print(f"   > Return Rule: Src {server_ip} -> Dst {client_ip}")
-            except Exception as e:
-                if "ALREADY_EXISTS" not in str(e):
-                    print(f"   > Error: {e}")
-
-    def update_switch_tables(self, priority_list):
-        # PHYSICAL TOPOLOGY MAPPING
-        server_info = {
-            "h2": {
-                "ip": "10.0.1.1",
-                "mac": "94:6d:ae:5c:87:72",
-                "port": 132, # 100G Port
-            },
-            "h3": {
-                "ip": "10.0.1.2",
-                "mac": "94:6d:ae:5d:fd:9c",
-                "port": 180  # 10G Port
-            },            
+        desired = {}
+        server_of = {}
+        for host, info in SERVER_INFO.items():
+            key_fields = tuple(sorted([
+                ("hdr.ipv4.srcAddr", bfrt_canonical(info["ip"])),
+                ("hdr.ipv4.dstAddr", bfrt_canonical(client_ip)),
+            ]))
+            desired[key_fields] = ("SwitchIngress.nat_reply_to_client", tuple(sorted([
+                ("client_mac", bfrt_canonical(client_mac)),
+                ("port", client_port),
+                ("server_id", self.server_ids[host]),
+            ])))
+            server_of[key_fields] = info["ip"]
+        for key_fields in self.sync_table(self.nat_table, desired):
+            print(f"   > Return Rule: Src {server_of[key_fields]} -> Dst {client_ip}")
+
+    def ecmp_entry(self, hostname):
+        info = SERVER_INFO[hostname]
+        return ("SwitchIngress.forward_to_server", tuple(sorted([
+            ("server_mac", bfrt_canonical(info["mac"])),
+            ("server_ip", bfrt_canonical(info["ip"])),
+            ("port", info["port"]),
+            ("server_id", self.server_ids[hostname]),
+        ])))
+
+    def write_ecmp(self, assignment):
+        entries = {
+            (("meta.ecmp_select", index),): self.ecmp_entry(hostname)
+            for index, hostname in assignment.items()
         }
-
-        print(f"--- Logic Update: Switch Priority {[x[0] for x in priority_list]} ---")
-
-        for index, server_tuple in enumerate(priority_list):
-            hostname = server_tuple[0]
-            if hostname not in server_info:
-                print(f"   > Warning: Unknown hostname '{hostname}' in priority list")
-                continue
-            info = server_info[hostname]
-
-            key = self.ecmp_table.make_key([gc.KeyTuple("meta.ecmp_select", index)])
-            data = self.ecmp_table.make_data(
-                [
-                    gc.DataTuple("server_mac", self.mac_to_bytes(info["mac"])),
-                    gc.DataTuple("server_ip", self.ipv4_to_bytes(info["ip"])),
-                    gc.DataTuple("port", info["port"]),
-                ],
-                "SwitchIngress.forward_to_server",
-            )
-
-            current = self.installed_keys.get(index)
-            print("Current is:" + str(current))
-
-            try:
-                if current == hostname:
-                    print("Equal! (No change needed)")
+        changed = self.sync_table(self.ecmp_table, entries, prune=True)
+        if changed:
+            self.installed_keys = self.cached_ecmp_assignment()
+        return len(changed)
+
+    def read_counters(self):
+        totals = {host: [0, 0, 0] for host in self.server_ids}
+        host_of = {i: host for host, i in self.server_ids.items()}
+        for table, replies in ((self.request_counter, False), (self.reply_counter, True)):
+            # One wildcard read returns every cell of the counter array
+            for data, key in table.entry_get(self.target, [], {"from_hw": True}):
+                host = host_of.get(key.to_dict()["$COUNTER_INDEX"]["value"])
+                if host is None:
                     continue
-                elif current is not None:
-                    print("Change (Modify)")
-                    self.ecmp_table.entry_mod(self.target, [key], [data])
+                fields = data.to_dict()
+                if replies:
+                    totals[host][1] = fields["$COUNTER_SPEC_PKTS"]
+                    totals[host][2] = fields["$COUNTER_SPEC_BYTES"]
                 else:
-                    print("Write (Add)")
-                    self.ecmp_table.entry_add(self.target, [key], [data])
-                    print(f"   > Index {index}: Inserted {hostname}")
+                    totals[host][0] = fields["$COUNTER_SPEC_PKTS"]
+        return {host: tuple(v) for host, v in totals.items()}
 
-                self.installed_keys[index] = hostname
-            except Exception as e_insert:
-                print(f"!!! CRITICAL ERROR writing Index {index} !!!")
-                print(f"    INSERT/MOD Error: {e_insert}")
-
-    def verify_table_state(self):
-        print("\n--- VERIFYING SWITCH STATE ---")
+    def verify(self):
         tables_to_check = [
             ("MyIngress.ecmp_nhop", self.ecmp_table),
             ("MyIngress.server_src_nat", self.nat_table),
@@ -181,108 +265,37 @@ class MyLBController:
                     print(f"  [OK] Table {name} has {count} entries.")
             except Exception as e:
                 print(f"  [ERROR] Failed to read {name}: {e}")
-        print("------------------------------\n")
 
-    def run_listener(self):
-        print("Starting UDP Listener on Port 50001...")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(("0.0.0.0", 50001))
 
-        while True:
-            data, addr = sock.recvfrom(1024)
-            try:
-                msg = data.decode().strip()
-                host, score, util = msg.split(",")
-                score, util = float(score), float(util)
-                
-                self.server_stats[host] = (score, util)
-                
-                # --- Update MAB State with new telemetry ---
-                self.update_mab_state(host, reward=score)
-                # -------------------------------------------
-
-                print(f"Received update from {host}: Score={score}, Util={util}%")
-                self.recompute_and_update()
-            except Exception as e:
-                print(f"Error parsing message: {e}")
-
-    def update_mab_state(self, host, reward):
-        """Updates the D-UCB state by decaying old data and adding the new observation."""
-        if host not in self.mab_counts:
-            self.mab_counts[host] = 0
-            self.mab_values[host] = 0.0
-            
-        # 1. Decay historical knowledge of ALL known servers
-        for h in self.mab_counts:
-            self.mab_counts[h] *= self.mab_gamma
-            self.mab_values[h] *= self.mab_gamma
-            
-        # 2. Add the brand new observation for the reporting server
-        self.mab_counts[host] += 1
-        self.mab_values[host] += reward
-        self.mab_total_pulls += 1
-
-    def mab_priority(self, N):
-        """Calculates D-UCB score for all servers and returns them sorted."""
-        ucb_scores = []
-        
-        for host in self.server_stats.keys():
-            # Initialization Phase: If we have no data, prioritize exploring it
-            if self.mab_counts.get(host, 0) == 0:
-                ucb_scores.append((host, float('inf')))
-                continue
-                
-            # Exploitation: What is the current expected energy efficiency?
-            exploitation = self.mab_values[host]
-            
-            # Exploration: Mathematical uncertainty bonus
-            exploration = 0
-            if self.mab_total_pulls > 1:
-                exploration = math.sqrt((2 * math.log(self.mab_total_pulls)) / float(self.mab_counts[host]))
-            
-            ucb = exploitation + exploration
-            ucb_scores.append((host, ucb))
-            
-        # Sort servers by their UCB score in descending order (highest score first)
-        ucb_scores.sort(key=lambda x: x[1], reverse=True)
-        ordered = ucb_scores[:N]
-        
-        print(f"--- MAB Algorithm Evaluated Priority: {[x[0] for x in ordered]} ---")
-        return ordered
-
-    def recompute_and_update(self, N=1):
-        # ordered = self.performance_only_priority(N)
-        # ordered = self.energy_aware_priority(N)
-        ordered = self.mab_priority(N) # <-- MAB policy activated here
-        if ordered:
-            self.update_switch_tables(ordered)
-
-    def energy_aware_priority(self, N):
-        available = []
-        busy = []
-        for host, (score, util) in self.server_stats.items():
-            if util < 70.0:
-                available.append((host, score))
-            else:
-                busy.append((host, score))
-        available.sort(key=lambda x: x[1], reverse=True)
-        busy.sort(key=lambda x: x[1], reverse=True)
-        ordered = (available + busy)[:N]
-        return ordered
-
-    def performance_only_priority(self, N):
-        allServers = []
-        for host, (score, util) in self.server_stats.items():
-            allServers.append((host, util))
-        allServers.sort(key=lambda x: x[1], reverse=False)
-        ordered = (allServers)[:N]
-        return ordered
-
-    def ipv4_to_bytes(self, ip_str):
-        """Helper to convert IPv4 strings to bytearrays for BFRT."""
-        import socket
-        return bytearray(socket.inet_aton(ip_str))
+class MyLBController(LBController):
+    """Controller for the Tofino switch, ranking servers with a bandit policy."""
+
+    def __init__(self, program_name="load_balance", grpc_addr="127.0.0.1:50052",
+                 tick_interval=telemetry_ingest.TICK_INTERVAL, ecmp_mode="priority",
+                 damper=None, metrics_port=METRICS_PORT, mab_policy="d-ucb",
+                 mab_arrays=False, score_source="agent", metrics_host=METRICS_HOST,
+                 listen=True):
+        super().__init__(
+            TofinoBackend(program_name, grpc_addr),
+            tick_interval=tick_interval, ecmp_mode=ecmp_mode, policy="mab",
+            higher_score_first=True, damper=damper, metrics_port=metrics_port,
+            mab_policy=mab_policy, mab_arrays=mab_arrays, score_source=score_source,
+            metrics_host=metrics_host, listen=listen,
+        )
 
 
 if __name__ == "__main__":
-    ctrl = MyLBController(program_name="load_balance", grpc_addr="127.0.0.1:50052")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Bandit controller for the Tofino switch")
+    parser.add_argument("--ecmp-mode", choices=ECMP_MODES, default="priority",
+                        help="'priority': top server(s) only; 'weighted': share by efficiency")
+    parser.add_argument("--mab-policy", choices=sorted(POLICIES), default="d-ucb",
+                        help="Bandit policy ranking the servers")
+    parser.add_argument("--score-source", choices=SCORE_SOURCES, default="agent",
+                        help="'agent': agents' own scores; 'switch': switch-counted replies/s "
+                             "per reported watt (agents run --throughput-source switch)")
+    parser.add_argument("--metrics-host", default=METRICS_HOST,
+                        help="Bind address of the /metrics endpoint")
+    args = parser.parse_args()
+    ctrl = MyLBController(program_name="load_balance", grpc_addr="127.0.0.1:50052",
+                          ecmp_mode=args.ecmp_mode, mab_policy=args.mab_policy,
+                          score_source=args.score_source, metrics_host=args.metrics_host)
\ No newline at end of file
@@ -196,6 +196,14 @@ class P4InfoHelper(object):
                 ])
         return table_entry
 
+    def buildRegisterEntry(self, register_name, index, value):
+        register = self.get("registers", name=register_name)
+        register_entry = p4runtime_pb2.RegisterEntry()
+        register_entry.register_id = register.preamble.id
+        register_entry.index.index = index
+        register_entry.data.bitstring = encode(value, register.type_spec.bitstring.bit.bitwidth)
+        return register_entry
+
     def buildMulticastGroupEntry(self, multicast_group_id, replicas):
         mc_entry = p4runtime_pb2.PacketReplicationEngineEntry()
         mc_entry.multicast_group_entry.multicast_group_id = multicast_group_id
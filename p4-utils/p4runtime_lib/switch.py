@@ -69,7 +69,7 @@ class SwitchConnection(object):
             for item in self.stream_msg_resp:
                 return item # just one
 
-    def SetForwardingPipelineConfig(self, p4info, dry_run=False, **kwargs):
+    def SetForwardingPipelineConfig(self, p4info, dry_run=False, cookie=None, **kwargs):
         device_config = self.buildDeviceConfig(**kwargs)
         request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
         request.election_id.low = 1
@@ -78,6 +78,8 @@ class SwitchConnection(object):
 
         config.p4info.CopyFrom(p4info)
         config.p4_device_config = device_config.SerializeToString()
+        if cookie is not None:
+            config.cookie.cookie = cookie
 
         request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
         if dry_run:
@@ -85,6 +87,16 @@ class SwitchConnection(object):
         else:
             self.client_stub.SetForwardingPipelineConfig(request)
 
+    def GetForwardingPipelineCookie(self):
+        """Returns the cookie of the installed pipeline, or None if there is none."""
+        request = p4runtime_pb2.GetForwardingPipelineConfigRequest()
+        request.device_id = self.device_id
+        request.response_type = p4runtime_pb2.GetForwardingPipelineConfigRequest.COOKIE_ONLY
+        response = self.client_stub.GetForwardingPipelineConfig(request)
+        if not response.config.HasField("cookie"):
+            return None
+        return response.config.cookie.cookie
+
     def WriteTableEntry(self, table_entry, dry_run=False):
         request = p4runtime_pb2.WriteRequest()
         request.device_id = self.device_id
@@ -100,6 +112,46 @@ class SwitchConnection(object):
         else:
             self.client_stub.Write(request)
 
+    def WriteTableEntries(self, updates, atomicity=None, dry_run=False):
+        """Sends a batch of (update_type, table_entry) pairs in one WriteRequest.
+
+        update_type is one of p4runtime_pb2.Update.{INSERT,MODIFY,DELETE}. The
+        whole batch costs a single Write RPC; with the default atomicity
+        (CONTINUE_ON_ERROR) failed updates are reported per index in the gRPC
+        error details (see error_utils.parseGrpcErrorBinaryDetails).
+        """
+        request = p4runtime_pb2.WriteRequest()
+        request.device_id = self.device_id
+        request.election_id.low = 1
+        if atomicity is not None:
+            request.atomicity = atomicity
+        for update_type, table_entry in updates:
+            update = request.updates.add()
+            update.type = update_type
+            update.entity.table_entry.CopyFrom(table_entry)
+        if not request.updates:
+            return
+        if dry_run:
+            print("P4Runtime Write:", request)
+        else:
+            self.client_stub.Write(request)
+
+    def WriteRegisterEntries(self, register_entries, dry_run=False):
+        """Writes register cells (p4runtime_pb2.RegisterEntry) in one WriteRequest."""
+        request = p4runtime_pb2.WriteRequest()
+        request.device_id = self.device_id
+        request.election_id.low = 1
+        for register_entry in register_entries:
+            update = request.updates.add()
+            update.type = p4runtime_pb2.Update.MODIFY
+            update.entity.register_entry.CopyFrom(register_entry)
+        if not request.updates:
+            return
+        if dry_run:
+            print("P4Runtime Write:", request)
+        else:
+            self.client_stub.Write(request)
+
     def ReadTableEntries(self, table_id=None, dry_run=False):
         request = p4runtime_pb2.ReadRequest()
         request.device_id = self.device_id
@@ -0,0 +1,107 @@
+import glob
+import logging
+import os
+
+# Linux powercap (RAPL) access shared by server_agent and rapl_expose.py:
+# pinned sysfs descriptors and per-zone energy counters with wraparound
+# correction.
+
+POWERCAP_ROOT = "/sys/class/powercap"  # RAPL zones intel-rapl:S and subzones intel-rapl:S:N
+
+
+class PinnedFile:
+    """Keeps one descriptor open and rereads it from offset 0 with os.pread.
+
+    Works for procfs/sysfs attributes, which regenerate their contents on
+    every read; files replaced by rename need reopening instead.
+    """
+
+    def __init__(self, path, size=4096):
+        self.path = path
+        self.size = size
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self):
+        return os.pread(self.fd, self.size, 0)
+
+    def read_int(self):
+        return int(self.read())
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_pinned(path, size=4096):
+    try:
+        return PinnedFile(path, size)
+    except OSError as e:
+        logging.error(f"Cannot open {path}: {e}")
+        return None
+
+
+class RaplDomain:
+    """One powercap zone's energy counter, corrected for wraparound."""
+
+    def __init__(self, label, energy_file, max_range):
+        self.label = label
+        self.file = energy_file
+        self.max_range = max_range
+        self.energy = None  # Raw counter at the last read
+        self.wraps = 0      # Times the counter wrapped at max_energy_range_uj
+
+    def read(self):
+        """Reads the raw counter, counting a wrap if it went backwards."""
+        energy = self.file.read_int()
+        if self.energy is not None and energy < self.energy:
+            self.wraps += 1
+        self.energy = energy
+        return energy
+
+    def cumulative(self):
+        """Microjoules counted since discovery, as of the last read."""
+        return self.wraps * self.max_range + self.energy
+
+    def delta(self):
+        """Microjoules since the previous read (None on the first read)."""
+        if self.energy is None:
+            self.read()
+            return None
+        before = self.cumulative()
+        self.read()
+        return self.cumulative() - before
+
+
+def discover_rapl_domains(root=POWERCAP_ROOT):
+    """Opens every RAPL zone and subzone under root.
+
+    Zones are packages (package-S) or the platform (psys); subzones are
+    labelled name-S with their socket S (core-0, uncore-0, dram-1, ...).
+    """
+    domains = []
+    for zone in sorted(glob.glob(f"{root}/intel-rapl:*")):
+        ids = os.path.basename(zone).split(":")[1:]
+        try:
+            with open(f"{zone}/name") as f:
+                name = f.read().strip()
+            with open(f"{zone}/max_energy_range_uj") as f:
+                max_range = int(f.read())
+        except (OSError, ValueError) as e:
+            logging.error(f"Skipping powercap zone {zone}: {e}")
+            continue
+        energy_file = open_pinned(f"{zone}/energy_uj")
+        if energy_file is None:
+            continue
+        label = name if len(ids) == 1 else f"{name}-{ids[0]}"
+        domains.append(RaplDomain(label, energy_file, max_range))
+    return domains
+
+
+def whole_server_domains(labels):
+    """Labels whose sum is the server's power without double counting.
+
+    psys already covers the whole platform; otherwise the packages (which
+    include their core/uncore subzones) plus DRAM, which RAPL meters apart.
+    """
+    if "psys" in labels:
+        return {"psys"}
+    return {l for l in labels if l.startswith("package-") or l.startswith("dram-")}
@@ -1,34 +1,187 @@
-import time
+import argparse
 import os
-import sys
+import select
+import socket
+import time
+
+import rapl_feed
+from powercap import POWERCAP_ROOT, discover_rapl_domains
+from rapl_page import RaplPageWriter
 
 # Path to the shared folder visible to the VM
 # UPDATE THIS PATH to match your actual shared folder location
-SHARED_FILE_PATH = "/home/ximit/Documents/energy_aware_load_balancer/rapl/rapl_value.txt"
+SHARED_PAGE_PATH = "/home/ximit/Documents/energy_aware_load_balancer/rapl/rapl_page.bin"
+PERIOD = 0.001  # Seconds between shared page samples
+
+
+class Subscriber:
+    def __init__(self, period, batch, now):
+        self.period = period
+        self.batch = batch
+        self.next_due = now + period
+        self.expires = now + rapl_feed.SUBSCRIPTION_TTL
+        self.last = None  # (host ns, cumulative uj per domain) of the last sample
+        self.pending = []
+        self.seq = 0
+
+
+class FanOut:
+    """Serves energy deltas to any number of subscribed guest agents.
+
+    The counters are read once per due deadline, however many subscribers
+    share it; each subscriber gets deltas at its own period, batched.
+    """
+
+    def __init__(self, spec, domains):
+        self.family, self.address = rapl_feed.parse_address(spec)
+        self.domains = domains
+        self.labels = [d.label for d in domains]
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        if self.family == socket.AF_UNIX:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self.sock.bind(self.address)
+            os.chmod(self.address, 0o666)  # Agents need not run as root
+        else:
+            self.sock.bind(self.address)
+        self.sock.setblocking(False)
+        self.subscribers = {}
+
+    def next_deadline(self):
+        return min((s.next_due for s in self.subscribers.values()), default=None)
+
+    def receive(self, now):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            if len(data) != rapl_feed.SUBSCRIBE.size or data[:4] != b"RSUB" or not addr:
+                continue
+            _, period_us, batch = rapl_feed.SUBSCRIBE.unpack(data)
+            if period_us == 0:
+                if self.subscribers.pop(addr, None):
+                    print(f"   > {addr} unsubscribed")
+                continue
+            period = max(rapl_feed.MIN_PERIOD, min(rapl_feed.MAX_PERIOD, period_us / 1000000.0))
+            batch = max(1, min(rapl_feed.MAX_BATCH, batch))
+            sub = self.subscribers.get(addr)
+            if sub is None or (sub.period, sub.batch) != (period, batch):
+                print(f"   > {addr} subscribed: every {period * 1000:.1f} ms, {batch} per datagram")
+                sub = self.subscribers[addr] = Subscriber(period, batch, now)
+            sub.expires = now + rapl_feed.SUBSCRIPTION_TTL
+            self._send(rapl_feed.pack_domains(self.labels), addr)
+
+    def serve_due(self, now, stamp_ns, cumulative):
+        """Hands a sample to every subscriber whose deadline has passed."""
+        for addr, sub in list(self.subscribers.items()):
+            if now >= sub.expires:
+                print(f"   > {addr} expired")
+                del self.subscribers[addr]
+                continue
+            if now < sub.next_due:
+                continue
+            sub.next_due += sub.period
+            if sub.next_due <= now:
+                sub.next_due = now + sub.period  # Fell behind: skip, don't burst
+            if sub.last is not None:
+                last_ns, last_energy = sub.last
+                deltas = [c - p for c, p in zip(cumulative, last_energy)]
+                sub.pending.append((stamp_ns, min(stamp_ns - last_ns, 0xFFFFFFFF), deltas))
+            sub.last = (stamp_ns, cumulative)
+            if len(sub.pending) >= sub.batch:
+                self._send(rapl_feed.pack_deltas(sub.seq, sub.pending, len(self.labels)), addr)
+                sub.seq += len(sub.pending)
+                sub.pending = []
+
+    def _send(self, frame, addr):
+        try:
+            self.sock.sendto(frame, addr)
+        except OSError:
+            pass  # Full buffer or vanished guest; the lease expires on its own
+
+    def close(self):
+        self.sock.close()
+        if self.family == socket.AF_UNIX:
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Publishes the host's RAPL counters to VM agents")
+    parser.add_argument("--page", default=SHARED_PAGE_PATH,
+                        help="Shared page file ('' disables the page)")
+    parser.add_argument("--period", type=float, default=PERIOD,
+                        help="Seconds between shared page samples")
+    parser.add_argument("--listen", default=None,
+                        help="Serve delta subscriptions on unix:/path or [udp:]host:port")
+    args = parser.parse_args()
+    if not (args.page or args.listen):
+        parser.error("nothing to publish: give --page and/or --listen")
+
     print(f"--- Starting RAPL Bridge ---")
-    print(f"Reading from: /sys/class/powercap/intel-rapl:0/energy_uj")
-    print(f"Writing to:   {SHARED_FILE_PATH}")
+    # 1. Open every hardware counter once (energy_uj requires root)
+    domains = discover_rapl_domains()
+    if not domains:
+        print(f"ERROR: No readable RAPL zones under {POWERCAP_ROOT} (run with sudo).")
+        return
+    print(f"Reading from: {[d.label for d in domains]}")
+    page = None
+    if args.page:
+        print(f"Writing to:   {args.page} (every {args.period * 1000:.1f} ms)")
+        page = RaplPageWriter(args.page, domains)
+    fanout = None
+    if args.listen:
+        print(f"Serving:      {args.listen}")
+        fanout = FanOut(args.listen, domains)
 
+    # 2. Sleep until the next page or subscriber deadline (or a subscribe
+    # request), read the counters once, and serve everyone due. The VM reads
+    # the page with the seqlock in rapl_page.py and never sees a torn sample
+    next_page = time.monotonic() if page else None
     try:
         while True:
-            # 1. Read Hardware Sensor (Requires Root)
-            with open("/sys/class/powercap/intel-rapl:0/energy_uj", "r") as f:
-                energy_uj = f.read().strip()
-            
-            # 2. Write to Shared File
-            # We overwrite the file instantly so the VM always sees the latest value
-            with open(SHARED_FILE_PATH, "w") as f:
-                f.write(energy_uj)
-            
-            # Update frequency (10Hz is enough for good granularity)
-            time.sleep(0.001)
-            
-    except PermissionError:
-        print("ERROR: You must run this script with sudo to read RAPL values.")
+            deadlines = [t for t in (next_page, fanout and fanout.next_deadline()) if t is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            if fanout:
+                readable, _, _ = select.select([fanout.sock], [], [], timeout)
+                if readable:
+                    fanout.receive(time.monotonic())
+            elif timeout:
+                time.sleep(timeout)
+
+            now = time.monotonic()
+            page_due = next_page is not None and now >= next_page
+            fanout_due = fanout is not None and fanout.subscribers and \
+                now >= fanout.next_deadline()
+            if not (page_due or fanout_due):
+                continue
+            stamp_ns = time.monotonic_ns()
+            try:
+                for d in domains:
+                    d.read()
+            except (OSError, ValueError):
+                continue  # Transient read failure: retry at the next wakeup
+            if page_due:
+                page.write(stamp_ns)
+                next_page += args.period
+                if next_page <= now:
+                    next_page = now + args.period  # Fell behind: skip, don't burst
+            if fanout_due:
+                fanout.serve_due(now, stamp_ns, [d.cumulative() for d in domains])
+
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(f"Error: {e}")
+    finally:
+        if page:
+            page.close()
+        if fanout:
+            fanout.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,136 @@
+import socket
+import struct
+import time
+
+# Datagram protocol of the RAPL fan-out daemon (rapl_expose.py --listen).
+# Guests subscribe over a Unix datagram socket or UDP and receive energy
+# deltas at their own period, several per datagram (network byte order):
+#
+#   subscribe : magic "RSUB" | period us u32 | samples per datagram u16
+#               (period 0 unsubscribes, longer than MAX_PERIOD is capped;
+#                resend within SUBSCRIPTION_TTL)
+#   domains   : magic "RDOM" | count u16 | count x label 16s
+#               (sent in reply to every subscribe)
+#   deltas    : magic "RDLT" | domain count u16 | sample count u16 | seq u32 |
+#               sample count x (host monotonic ns u64 | span ns u32 |
+#                               domain count x energy delta uj u64)
+#
+# Each delta covers the span ending at its timestamp, wraparound already
+# corrected; seq numbers samples per subscriber so gaps reveal loss.
+
+SUBSCRIBE = struct.Struct("!4sIH")
+DOMAINS_HEADER = struct.Struct("!4sH")
+DELTAS_HEADER = struct.Struct("!4sHHI")
+SAMPLE_HEADER = struct.Struct("!QI")
+LABEL = struct.Struct("!16s")
+DELTA = struct.Struct("!Q")
+SUBSCRIPTION_TTL = 5.0  # Seconds a subscription lives without a refresh
+MIN_PERIOD = 0.001
+MAX_PERIOD = 4.0  # A sample's span must fit the u32 ns field (~4.29 s)
+MAX_BATCH = 64
+DEFAULT_PORT = 50010
+
+
+def parse_address(spec):
+    """'unix:/path' or '[udp:]host[:port]' -> (family, address)."""
+    if spec.startswith("unix:"):
+        return socket.AF_UNIX, spec[len("unix:"):]
+    if spec.startswith("udp:"):
+        spec = spec[len("udp:"):]
+    host, sep, port = spec.rpartition(":")
+    if not sep:
+        host, port = spec, ""  # Host alone: default port
+    return socket.AF_INET, (host or "127.0.0.1", int(port or DEFAULT_PORT))
+
+
+def pack_subscribe(period, batch):
+    return SUBSCRIBE.pack(b"RSUB", int(round(period * 1000000)), batch)
+
+
+def pack_domains(labels):
+    frame = DOMAINS_HEADER.pack(b"RDOM", len(labels))
+    return frame + b"".join(LABEL.pack(label.encode()) for label in labels)
+
+
+def pack_deltas(seq, samples, domain_count):
+    """samples: [(host ns, span ns, [delta uj per domain])]."""
+    parts = [DELTAS_HEADER.pack(b"RDLT", domain_count, len(samples), seq & 0xFFFFFFFF)]
+    row = struct.Struct(f"!{domain_count}Q")
+    for stamp_ns, span_ns, deltas in samples:
+        parts.append(SAMPLE_HEADER.pack(stamp_ns, span_ns))
+        parts.append(row.pack(*deltas))
+    return b"".join(parts)
+
+
+class RaplFeed:
+    """Guest side subscription: drains energy deltas without blocking."""
+
+    def __init__(self, spec, period, batch=1):
+        self.family, self.address = parse_address(spec)
+        self.period = max(MIN_PERIOD, min(MAX_PERIOD, period))
+        self.batch = max(1, min(MAX_BATCH, batch))
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        if self.family == socket.AF_UNIX:
+            self.sock.bind("")  # Autobind so the daemon can reply
+        self.sock.setblocking(False)
+        self.labels = None
+        self.seq = None
+        self.lost = 0
+        self.subscribed_at = None
+
+    def subscribe(self):
+        try:
+            self.sock.sendto(pack_subscribe(self.period, self.batch), self.address)
+        except OSError:
+            pass  # Daemon not up yet; retried on the next poll
+        self.subscribed_at = time.monotonic()
+
+    def poll(self):
+        """Returns [(host seconds, span seconds, {label: delta uj})] received so far."""
+        if self.subscribed_at is None or \
+                time.monotonic() - self.subscribed_at > SUBSCRIPTION_TTL / 2:
+            self.subscribe()
+        samples = []
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return samples
+            except OSError:
+                return samples  # e.g. ECONNREFUSED from an earlier send
+            magic = data[:4]
+            if magic == b"RDOM":
+                _, count = DOMAINS_HEADER.unpack_from(data, 0)
+                self.labels = [
+                    LABEL.unpack_from(data, DOMAINS_HEADER.size + i * LABEL.size)[0]
+                    .rstrip(b"\0").decode() for i in range(count)
+                ]
+            elif magic == b"RDLT" and self.labels is not None:
+                samples.extend(self._unpack_deltas(data))
+
+    def _unpack_deltas(self, data):
+        _, count, n, seq = DELTAS_HEADER.unpack_from(data, 0)
+        if count != len(self.labels):
+            return []  # Domain set changed; wait for the next RDOM
+        if self.seq is not None:
+            gap = (seq - self.seq) & 0xFFFFFFFF
+            if gap < 0x80000000:
+                self.lost += gap
+        self.seq = (seq + n) & 0xFFFFFFFF
+        row = struct.Struct(f"!{count}Q")
+        offset = DELTAS_HEADER.size
+        samples = []
+        for _ in range(n):
+            stamp_ns, span_ns = SAMPLE_HEADER.unpack_from(data, offset)
+            offset += SAMPLE_HEADER.size
+            deltas = row.unpack_from(data, offset)
+            offset += row.size
+            samples.append((stamp_ns / 1e9, span_ns / 1e9, dict(zip(self.labels, deltas))))
+        return samples
+
+    def close(self):
+        try:
+            self.sock.sendto(pack_subscribe(0, 0), self.address)
+        except OSError:
+            pass
+        self.sock.close()
@@ -0,0 +1,116 @@
+import mmap
+import os
+import struct
+
+# Shared RAPL page published by rapl_expose.py on the host and read by
+# server_agent --driver shared inside a VM. The page is a file mapped by both
+# sides, e.g. on a DAX-enabled virtio-fs share or an ivshmem region
+# (little-endian):
+#
+#   header : seq u64 | magic "RAPL" | version u16 | domain count u16 |
+#            host monotonic ns u64
+#   domain : label 16s | energy uj u64 | max energy range uj u64 | wraps u64
+#
+# The writer bumps seq to odd, updates the timestamp and counters, and bumps
+# it back to even; readers retry until seq is even and unchanged around
+# their copy, so they never see a torn sample. Labels and ranges are fixed
+# when the page is created.
+
+PAGE_MAGIC = b"RAPL"
+PAGE_VERSION = 1
+PAGE_SIZE = mmap.PAGESIZE
+HEADER = struct.Struct("<Q4sHHQ")
+DOMAIN = struct.Struct("<16sQQQ")
+_SEQ = struct.Struct("<Q")
+_STAMP = struct.Struct("<Q")
+_COUNTERS = struct.Struct("<QQQ")
+LABEL_LEN = 16
+MAX_DOMAINS = (PAGE_SIZE - HEADER.size) // DOMAIN.size
+READ_RETRIES = 100
+
+
+def _domain_offset(i):
+    return HEADER.size + i * DOMAIN.size
+
+
+class RaplPageWriter:
+    """Host side: publishes powercap.RaplDomain counters into the page at path."""
+
+    def __init__(self, path, domains):
+        if len(domains) > MAX_DOMAINS:
+            raise ValueError(f"At most {MAX_DOMAINS} domains fit in one page")
+        self.path = path
+        self.domains = domains
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, PAGE_SIZE)
+            self.mm = mmap.mmap(fd, PAGE_SIZE)
+        finally:
+            os.close(fd)
+        self.seq = 1  # Odd until the first sample is complete
+        HEADER.pack_into(self.mm, 0, self.seq, PAGE_MAGIC, PAGE_VERSION, len(domains), 0)
+        for i, d in enumerate(domains):
+            label = d.label.encode()
+            if len(label) > LABEL_LEN:
+                raise ValueError(f"Domain label '{d.label}' longer than {LABEL_LEN} bytes")
+            DOMAIN.pack_into(self.mm, _domain_offset(i), label, 0, d.max_range, 0)
+
+    def publish(self, stamp_ns):
+        """Reads every domain and publishes the counters taken at stamp_ns."""
+        for d in self.domains:
+            d.read()
+        self.write(stamp_ns)
+
+    def write(self, stamp_ns):
+        """Publishes the counters as of the domains' last read at stamp_ns."""
+        if not self.seq & 1:
+            self.seq += 1
+            _SEQ.pack_into(self.mm, 0, self.seq)
+        _STAMP.pack_into(self.mm, HEADER.size - _STAMP.size, stamp_ns)
+        for i, d in enumerate(self.domains):
+            _COUNTERS.pack_into(self.mm, _domain_offset(i) + LABEL_LEN, d.energy, d.max_range, d.wraps)
+        self.seq += 1
+        _SEQ.pack_into(self.mm, 0, self.seq)
+
+    def close(self):
+        self.mm.close()
+
+
+class RaplPageReader:
+    """Guest side: consistent snapshots of a RaplPageWriter page."""
+
+    def __init__(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.mm = mmap.mmap(fd, PAGE_SIZE, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        _, magic, version, count, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != PAGE_MAGIC or version != PAGE_VERSION:
+            raise ValueError(f"{path} is not a version {PAGE_VERSION} RAPL page")
+        self.labels = []
+        for i in range(count):
+            label = DOMAIN.unpack_from(self.mm, _domain_offset(i))[0]
+            self.labels.append(label.rstrip(b"\0").decode())
+        self._counters = struct.Struct("<" + "16sQQQ" * count)
+
+    def read(self):
+        """Returns (host seconds, {label: cumulative uj}), or None if the
+        writer has not completed a sample or kept the page busy."""
+        for _ in range(READ_RETRIES):
+            before = _SEQ.unpack_from(self.mm, 0)[0]
+            if before & 1:
+                continue
+            stamp_ns = _STAMP.unpack_from(self.mm, HEADER.size - _STAMP.size)[0]
+            values = self._counters.unpack_from(self.mm, HEADER.size)
+            if _SEQ.unpack_from(self.mm, 0)[0] != before:
+                continue
+            energy = {}
+            for i, label in enumerate(self.labels):
+                raw, max_range, wraps = values[4 * i + 1:4 * i + 4]
+                energy[label] = wraps * max_range + raw
+            return stamp_ns / 1e9, energy
+        return None
+
+    def close(self):
+        self.mm.close()
@@ -0,0 +1,136 @@
+import heapq
+
+# Incremental indices over server telemetry so the policies read their top-N
+# directly instead of re-sorting server_stats on every report.
+# Updates are O(log n); reading the top N is O(N log N) regardless of pool size.
+
+BUSY_UTIL = 70.0  # CPU % at which a server drops to the busy tier
+
+
+class ScoreIndex:
+    """Indexed binary min-heap of (value, host), keyed by host.
+
+    With reverse=True the largest values come first.
+    """
+
+    def __init__(self, reverse=False):
+        self.sign = -1.0 if reverse else 1.0
+        self.heap = []  # [(signed_value, host)]
+        self.pos = {}   # host -> position in heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, host):
+        return host in self.pos
+
+    def get(self, host, default=None):
+        i = self.pos.get(host)
+        return default if i is None else self.heap[i][0] * self.sign
+
+    def update(self, host, value):
+        item = (value * self.sign, host)
+        i = self.pos.get(host)
+        if i is None:
+            self.heap.append(item)
+            self.pos[host] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+            return
+        old = self.heap[i]
+        self.heap[i] = item
+        if item < old:
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+
+    def discard(self, host):
+        i = self.pos.pop(host, None)
+        if i is None:
+            return
+        last = self.heap.pop()
+        if i == len(self.heap):
+            return
+        self.heap[i] = last
+        self.pos[last[1]] = i
+        if i > 0 and last < self.heap[(i - 1) >> 1]:
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+
+    def top(self, n):
+        """Returns the first n (host, value) pairs in order without touching the heap."""
+        out = []
+        if n <= 0 or not self.heap:
+            return out
+        frontier = [(self.heap[0], 0)]
+        while frontier and len(out) < n:
+            (value, host), i = heapq.heappop(frontier)
+            out.append((host, value * self.sign))
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < len(self.heap):
+                    heapq.heappush(frontier, (self.heap[c], c))
+        return out
+
+    def _swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.pos[heap[i][1]] = i
+        self.pos[heap[j][1]] = j
+
+    def _sift_up(self, i):
+        heap = self.heap
+        while i > 0:
+            parent = (i - 1) >> 1
+            if heap[i] < heap[parent]:
+                self._swap(i, parent)
+                i = parent
+            else:
+                break
+
+    def _sift_down(self, i):
+        heap = self.heap
+        n = len(heap)
+        while True:
+            smallest = i
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < n and heap[c] < heap[smallest]:
+                    smallest = c
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+
+class ServerScoreIndex:
+    """Keeps the orderings used by energy_aware_priority and
+    performance_only_priority up to date as reports arrive."""
+
+    def __init__(self, higher_score_first=True):
+        self.available = ScoreIndex(reverse=higher_score_first)
+        self.busy = ScoreIndex(reverse=higher_score_first)
+        self.by_util = ScoreIndex()
+
+    def update(self, host, score, util):
+        if util < BUSY_UTIL:
+            self.busy.discard(host)
+            self.available.update(host, score)
+        else:
+            self.available.discard(host)
+            self.busy.update(host, score)
+        self.by_util.update(host, util)
+
+    def discard(self, host):
+        self.available.discard(host)
+        self.busy.discard(host)
+        self.by_util.discard(host)
+
+    def energy_aware_top(self, n):
+        """Available servers by score, then busy ones by score: [(host, score)]."""
+        ordered = self.available.top(n)
+        if len(ordered) < n:
+            ordered += self.busy.top(n - len(ordered))
+        return ordered
+
+    def performance_top(self, n):
+        """Least utilised servers first: [(host, util)]."""
+        return self.by_util.top(n)
@@ -0,0 +1,152 @@
+import csv
+import io
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+# Asynchronous log writer for server_agent. Rows go through a bounded queue
+# to a background thread that batches them and writes each batch with one
+# syscall, so the sampling loop never blocks on the filesystem. When the
+# queue is full rows are dropped and counted rather than stalling the agent.
+#
+# Formats:
+#   csv    : header line plus one text row per record
+#   binary : BINARY_MAGIC, one JSON line {"columns", "struct"}, then
+#            fixed-width little-endian records (read_binary_log decodes them;
+#            numpy can load them with np.fromfile and an offset)
+
+BINARY_MAGIC = b"EALOG1\n"
+QUEUE_SIZE = 4096
+FLUSH_ROWS = 256        # Flush once this many rows are buffered...
+FLUSH_INTERVAL = 1.0    # ...or this many seconds after the previous flush
+MAX_BYTES = 64 * 1024 * 1024
+BACKUPS = 3
+
+
+class LogWriter:
+    """Writes rows for `fields` [(name, struct code, text format)] to path.
+
+    Rotation moves path to path.1 (path.1 to path.2, ...) once it exceeds
+    max_bytes, keeping `backups` old files; max_bytes=0 never rotates.
+    """
+
+    def __init__(self, path, fields, fmt="csv", max_bytes=MAX_BYTES, backups=BACKUPS,
+                 flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        if fmt not in ("csv", "binary"):
+            raise ValueError("fmt must be 'csv' or 'binary'")
+        self.path = path
+        self.names = [name for name, _, _ in fields]
+        self.text_formats = [text for _, _, text in fields]
+        self.record = struct.Struct("<" + "".join(code for _, code, _ in fields))
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.fd = None
+        self.size = 0
+        self._open()
+        self.thread = threading.Thread(target=self._run, name=f"log:{os.path.basename(path)}",
+                                       daemon=True)
+        self.thread.start()
+
+    def write(self, row):
+        """Queues one row without blocking; returns False if it was dropped."""
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        """Writes everything queued so far and stops the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+        os.close(self.fd)
+        if self.dropped:
+            logging.warning(f"{self.path}: {self.dropped} rows dropped (queue full)")
+
+    def _header(self):
+        if self.fmt == "binary":
+            meta = {"columns": self.names, "struct": self.record.format}
+            return BINARY_MAGIC + json.dumps(meta).encode() + b"\n"
+        return self._encode_csv([self.names])
+
+    def _encode_csv(self, rows):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue().encode()
+
+    def _encode(self, rows):
+        if self.fmt == "binary":
+            return b"".join(
+                self.record.pack(*(v.encode() if isinstance(v, str) else v for v in row))
+                for row in rows
+            )
+        return self._encode_csv(
+            [fmt % value for fmt, value in zip(self.text_formats, row)] for row in rows
+        )
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.size = os.write(self.fd, self._header())
+
+    def _rotate(self):
+        os.close(self.fd)
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self._open()
+
+    def _flush(self, rows):
+        if not rows:
+            return
+        try:
+            self.size += os.write(self.fd, self._encode(rows))
+            if self.max_bytes and self.size >= self.max_bytes:
+                self._rotate()
+        except (OSError, struct.error, TypeError, ValueError) as e:
+            logging.error(f"Log write to {self.path} failed: {e}")
+
+    def _run(self):
+        rows = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                row = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                row = False
+            if row is None:
+                self._flush(rows)
+                return
+            if row is not False:
+                rows.append(row)
+            if len(rows) >= self.flush_rows or time.monotonic() >= deadline:
+                self._flush(rows)
+                rows = []
+                deadline = time.monotonic() + self.flush_interval
+
+
+def read_binary_log(path):
+    """Returns (columns, [row tuples]) from a binary log file."""
+    with open(path, "rb") as f:
+        if f.readline() != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary agent log")
+        meta = json.loads(f.readline())
+        record = struct.Struct(meta["struct"])
+        data = f.read()
+    usable = len(data) - len(data) % record.size  # Drop a torn last record
+    rows = [
+        tuple(v.rstrip(b"\0").decode() if isinstance(v, bytes) else v for v in row)
+        for row in record.iter_unpack(data[:usable])
+    ]
+    return meta["columns"], rows
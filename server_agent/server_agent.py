@@ -3,19 +3,37 @@ import socket
 import os
 import logging
 import argparse
-import csv
 import glob
+import math
+import sys
+
+# telemetry_protocol, shm_stats, powercap and the rapl_* modules live at the
+# repository root, next to the controllers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import shm_stats
+import telemetry_protocol
+from powercap import PinnedFile, discover_rapl_domains, open_pinned, whole_server_domains
+import rapl_feed
+from rapl_page import RaplPageReader
+
+import log_writer
 
 # --- Configuration ---
 # SWITCH_IP = "127.0.0.1"
 SWITCH_IP = "143.54.51.26"
 
 PORT = 50001
-INTERVAL = 0.5
+INTERVAL = 0.5            # Seconds between reports
+SAMPLE_INTERVAL = INTERVAL  # Default: one power sample per report (or per adaptive check)
+FINE_SAMPLE_INTERVAL = 0.01  # Sampling faster than this costs noticeable CPU on the measured server
+CHECK_INTERVAL = 0.1      # Adaptive mode: seconds between change checks
+HEARTBEAT = 2.0           # Adaptive mode: longest silence between reports
+SCORE_DELTA = 0.1         # Adaptive mode: relative score change that forces a report
+UTIL_DELTA = 10.0         # Adaptive mode: CPU utilization change (points) that forces a report
 LOG_DIR = "../sift/logs"
-RAPL_PATH = (
-    "/sys/class/powercap/intel-rapl/intel-rapl:0/energy_uj"  # Standard RAPL path
-)
+RAPL_PAGE_PATH = "../rapl/rapl_page.bin"  # Shared folder written by rapl_expose.py on the host
+FEED_BATCH_SPAN = 0.05  # --driver feed: seconds of deltas per datagram from rapl_expose.py
+FEED_WAIT = 2.0         # --driver feed: seconds to wait for the domain list at startup
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
@@ -34,14 +52,32 @@ def get_zenpower_path():
     return None
 
 
-def get_cpu_utilization(prev_idle, prev_total):
+class Ewma:
+    """Exponentially weighted moving average with a time constant of tau seconds.
+
+    Weighting by elapsed time keeps the smoothing independent of the
+    sampling rate and of late samples. tau 0 keeps just the latest sample.
+    """
+
+    def __init__(self, tau):
+        self.tau = tau
+        self.value = None
+
+    def update(self, x, dt):
+        if self.value is None or self.tau <= 0:
+            self.value = x
+        else:
+            self.value += (1.0 - math.exp(-dt / self.tau)) * (x - self.value)
+        return self.value
+
+
+def get_cpu_utilization(stat_file, prev_idle, prev_total):
     """Reads global CPU utilization."""
     try:
-        with open("/proc/stat", "r") as f:
-            line = f.readline()
-            metrics = list(map(int, line.split()[1:]))
-            curr_idle = metrics[3] + metrics[4]
-            curr_total = sum(metrics)
+        line = stat_file.read().split(b"\n", 1)[0]
+        metrics = list(map(int, line.split()[1:]))
+        curr_idle = metrics[3] + metrics[4]
+        curr_total = sum(metrics)
         diff_idle = curr_idle - prev_idle
         diff_total = curr_total - prev_total
         if diff_total == 0:
@@ -52,32 +88,127 @@ def get_cpu_utilization(prev_idle, prev_total):
         return 0.0, prev_idle, prev_total
 
 
-def get_power_watts(driver, hwmon_path, prev_energy, time_delta):
-    """
-    Selects power reading method based on the driver parameter.
-    Returns (power_in_watts, current_energy_reading).
-    """
-    try:
-        if driver == "amd" and hwmon_path:
-            # Zenpower: Sum of Core and SoC power in microwatts
-            with open(f"{hwmon_path}/power1_input", "r") as f:
-                p_core = int(f.read()) / 1000000.0
-            with open(f"{hwmon_path}/power2_input", "r") as f:
-                p_soc = int(f.read()) / 1000000.0
-            return p_core + p_soc, None
+class PowerSampler:
+    """Per-domain power from RAPL (energy deltas), Zenpower (power inputs),
+    the host's shared RAPL page or a rapl_expose.py delta subscription (both
+    energy over host time)."""
 
+    def __init__(self, driver, hwmon_path, rapl_page=None, feed_address=None,
+                 sample_interval=SAMPLE_INTERVAL):
+        self.files = {}
+        self.rapl = []
+        self.page = None
+        self.page_sample = None
+        self.feed = None
+        self.stamp = None
+        if driver == "feed":
+            self.feed = rapl_feed.RaplFeed(feed_address, sample_interval,
+                                 batch=round(FEED_BATCH_SPAN / sample_interval))
+            deadline = time.monotonic() + FEED_WAIT
+            while self.feed.labels is None and time.monotonic() < deadline:
+                self.feed.poll()
+                time.sleep(0.05)
+            if self.feed.labels is None:
+                logging.error(f"No answer from the RAPL feed at {feed_address}")
+            else:
+                self.total_labels = whole_server_domains(self.feed.labels)
+        elif driver == "shared":
+            try:
+                self.page = RaplPageReader(rapl_page)
+                self.total_labels = whole_server_domains(self.page.labels)
+            except (OSError, ValueError) as e:
+                logging.error(f"Cannot map RAPL page {rapl_page}: {e}")
+        elif driver == "amd" and hwmon_path:
+            # Zenpower: Core and SoC power in microwatts
+            for label, i in (("core", 1), ("soc", 2)):
+                f = open_pinned(f"{hwmon_path}/power{i}_input")
+                if f is not None:
+                    self.files[label] = f
+            self.total_labels = set(self.files)
         elif driver == "intel":
-            # RAPL: Differential energy in microjoules converted to Watts
-            with open(RAPL_PATH, "r") as f:
-                curr_energy = int(f.read())
-            if prev_energy is None:
-                return 0.0, curr_energy
-            power = (curr_energy - prev_energy) / 1000000.0 / time_delta
-            return max(0.0, power), curr_energy
+            self.rapl = discover_rapl_domains()
+            self.total_labels = whole_server_domains([d.label for d in self.rapl])
+        self.labels = list(self.files) + [d.label for d in self.rapl]
+        if self.page is not None:
+            self.labels = list(self.page.labels)
+        if self.feed is not None and self.feed.labels is not None:
+            self.labels = list(self.feed.labels)
+        self.driver = driver if self.labels else None
+        if self.driver:
+            logging.info(f"Power domains: {self.labels} (total = {sorted(self.total_labels)})")
+
+    def sample(self, now):
+        """Returns {domain: watts} at monotonic time now, or None if unavailable."""
+        try:
+            if self.driver == "amd":
+                return {label: f.read_int() / 1000000.0 for label, f in self.files.items()}
+            if self.driver == "feed":
+                # Sum every delta received since the last call
+                samples = self.feed.poll()
+                span = sum(s[1] for s in samples)
+                if not span:
+                    return None
+                energy = {}
+                for _, _, deltas in samples:
+                    for label, delta in deltas.items():
+                        energy[label] = energy.get(label, 0) + delta
+                return {label: e / 1000000.0 / span for label, e in energy.items()}
+            if self.driver == "shared":
+                # Energy and time both come from the host, so the rate is
+                # exact whatever the guest's clock does
+                sample = self.page.read()
+                prev, self.page_sample = self.page_sample, sample or self.page_sample
+                if sample is None or prev is None or sample[0] <= prev[0]:
+                    return None
+                elapsed = sample[0] - prev[0]
+                return {label: (energy - prev[1][label]) / 1000000.0 / elapsed
+                        for label, energy in sample[1].items()}
+            if self.driver == "intel":
+                # RAPL: Differential energy in microjoules converted to Watts
+                deltas = [(d.label, d.delta()) for d in self.rapl]
+                prev_stamp, self.stamp = self.stamp, now
+                if prev_stamp is None or now <= prev_stamp:
+                    return None
+                elapsed = now - prev_stamp
+                return {label: delta / 1000000.0 / elapsed
+                        for label, delta in deltas if delta is not None}
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def total(self, watts):
+        return sum(w for label, w in watts.items() if label in self.total_labels)
+
+
+class ReportGate:
+    """Decides when the adaptive mode pushes a report.
+
+    A report goes out as soon as the score moves by more than score_delta
+    (relative) or the utilization by more than util_delta points since the
+    last one sent; otherwise only a heartbeat every `heartbeat` seconds.
+    """
+
+    def __init__(self, score_delta, util_delta, heartbeat):
+        self.score_delta = score_delta
+        self.util_delta = util_delta
+        self.heartbeat = heartbeat
+        self.sent = None  # (time, score, util) of the last report sent
+
+    def check(self, now, score, util):
+        """Returns "change", "heartbeat" or None (stay quiet)."""
+        if self.sent is None:
+            return "change"
+        sent_at, sent_score, sent_util = self.sent
+        if abs(score - sent_score) > self.score_delta * max(abs(sent_score), 1e-9):
+            return "change"
+        if abs(util - sent_util) > self.util_delta:
+            return "change"
+        if now - sent_at >= self.heartbeat:
+            return "heartbeat"
+        return None
 
-    except Exception:
-        pass
-    return None, None
+    def mark_sent(self, now, score, util):
+        self.sent = (now, score, util)
 
 
 def main():
@@ -85,11 +216,134 @@ def main():
     parser.add_argument("host_name", help="Name of this host")
     parser.add_argument(
         "--driver",
-        choices=["intel", "amd"],
+        choices=["intel", "amd", "shared", "feed"],
         default="intel",
-        help="Telemetry driver: 'intel' (RAPL) or 'amd' (Zenpower)",
+        help="Telemetry driver: 'intel' (RAPL), 'amd' (Zenpower), or for VMs 'shared' "
+        "(the host's RAPL page) or 'feed' (subscribe to rapl_expose.py --listen)",
+    )
+    parser.add_argument(
+        "--rapl-feed",
+        default=None,
+        help="rapl_expose.py --listen address (unix:/path or [udp:]host[:port], port "
+        f"{rapl_feed.DEFAULT_PORT} by default) for --driver feed; from a VM this is the "
+        "host's address on the guest network, e.g. udp:10.0.2.2 with QEMU user networking",
+    )
+    parser.add_argument(
+        "--rapl-page",
+        default=RAPL_PAGE_PATH,
+        help="Shared RAPL page for --driver shared",
+    )
+    parser.add_argument(
+        "--protocol",
+        choices=["binary", "text"],
+        default="binary",
+        help="Report format: versioned binary frames or legacy 'host,score,util' text",
+    )
+    parser.add_argument(
+        "--throughput-source",
+        choices=["file", "shm", "switch"],
+        default="file",
+        help="'file': read {host}_throughput.txt written by the SIFT server (on by default); "
+        "'shm': read the shared-memory stats of the SIFT server --stats-shm; "
+        "'switch': report power only, for a controller run with --score-source switch "
+        "on a backend with per-server counters (binary protocol only)",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=None,
+        help="Seconds between power samples; each report carries their EWMA "
+        f"(default: the report or check interval; under {FINE_SAMPLE_INTERVAL} s only "
+        "when asked for, as sampling runs on the server being measured)",
+    )
+    parser.add_argument(
+        "--report-mode",
+        choices=["periodic", "adaptive"],
+        default="periodic",
+        help="'periodic': report every interval; 'adaptive': report on significant "
+        "score/utilization changes plus a heartbeat",
+    )
+    parser.add_argument(
+        "--check-interval",
+        type=float,
+        default=CHECK_INTERVAL,
+        help="Adaptive mode: seconds between change checks",
+    )
+    parser.add_argument(
+        "--score-delta",
+        type=float,
+        default=SCORE_DELTA,
+        help="Adaptive mode: relative score change that triggers a report",
+    )
+    parser.add_argument(
+        "--util-delta",
+        type=float,
+        default=UTIL_DELTA,
+        help="Adaptive mode: CPU utilization change (percentage points) that triggers a report",
+    )
+    parser.add_argument(
+        "--heartbeat",
+        type=float,
+        default=HEARTBEAT,
+        help="Adaptive mode: seconds between reports when nothing changes",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=["csv", "binary"],
+        default="csv",
+        help="Energy log format: {host}_energy.csv or fixed-width binary {host}_energy.bin",
+    )
+    parser.add_argument(
+        "--log-max-bytes",
+        type=int,
+        default=log_writer.MAX_BYTES,
+        help="Rotate a log file once it reaches this size (0 disables rotation)",
+    )
+    parser.add_argument(
+        "--log-backups",
+        type=int,
+        default=log_writer.BACKUPS,
+        help="Rotated log files kept next to the live one",
+    )
+    parser.add_argument(
+        "--power-trace",
+        action="store_true",
+        help="Also log every raw power sample to {host}_power_trace.{csv,bin}",
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=1,
+        help="Samples packed per binary datagram in periodic mode (1 sends every sample "
+        "immediately; adaptive reports are always sent at once)",
     )
     args = parser.parse_args()
+    if not 1 <= args.batch <= telemetry_protocol.MAX_SAMPLES_PER_FRAME:
+        parser.error(f"--batch must be in 1..{telemetry_protocol.MAX_SAMPLES_PER_FRAME}")
+    if args.sample_interval is None:
+        args.sample_interval = min(
+            SAMPLE_INTERVAL, args.check_interval if args.report_mode == "adaptive" else INTERVAL
+        )
+    if not 0 < args.sample_interval <= INTERVAL:
+        parser.error(f"--sample-interval must be in (0, {INTERVAL}]")
+    if args.sample_interval < FINE_SAMPLE_INTERVAL:
+        logging.warning(
+            f"Sampling power every {args.sample_interval * 1000:.1f} ms; the sampling "
+            "itself adds load to the server being measured"
+        )
+    if args.driver == "feed" and not args.rapl_feed:
+        # No useful default: a guest reaches the host daemon by the host's address
+        parser.error("--driver feed needs --rapl-feed with the host daemon's address")
+    if args.throughput_source == "switch" and args.protocol == "text":
+        # Text reports carry no power, so the controller could not rescore them
+        parser.error("--throughput-source switch needs --protocol binary")
+    report_interval = INTERVAL
+    gate = None
+    if args.report_mode == "adaptive":
+        if not args.sample_interval <= args.check_interval <= args.heartbeat:
+            parser.error("need --sample-interval <= --check-interval <= --heartbeat")
+        report_interval = args.check_interval
+        gate = ReportGate(args.score_delta, args.util_delta, args.heartbeat)
 
     hwmon_path = get_zenpower_path() if args.driver == "amd" else None
     if args.driver == "amd" and not hwmon_path:
@@ -99,85 +353,171 @@ def main():
 
     if not os.path.exists(LOG_DIR):
         os.makedirs(LOG_DIR)
-    csv_file = f"{LOG_DIR}/{args.host_name}_energy.csv"
-
-    with open(csv_file, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(
-            [
-                "timestamp",
-                "host",
-                "cpu_util",
-                "throughput_rps",
-                "power_watts",
-                "efficiency_score",
-            ]
+    extension = "csv" if args.log_format == "csv" else "bin"
+    throughput_file = f"{LOG_DIR}/{args.host_name}_throughput.txt"
+
+    sampler = PowerSampler(
+        args.driver, hwmon_path, args.rapl_page, args.rapl_feed, args.sample_interval
+    )
+    domain_fields = [(f"{label}_watts", "f", "%.2f") for label in sampler.labels]
+    log_options = dict(fmt=args.log_format, max_bytes=args.log_max_bytes, backups=args.log_backups)
+    energy_log = log_writer.LogWriter(
+        f"{LOG_DIR}/{args.host_name}_energy.{extension}",
+        [
+            ("timestamp", "d", "%s"),
+            ("host", f"{telemetry_protocol.HOST_NAME_LEN}s", "%s"),
+            ("cpu_util", "f", "%.2f"),
+            ("throughput_rps", "f", "%.2f"),
+            ("power_watts", "f", "%.2f"),
+            ("efficiency_score", "f", "%.4f"),
+        ]
+        + domain_fields,
+        **log_options,
+    )
+    # Optional raw trace: every power sample, before averaging
+    power_trace = None
+    if args.power_trace:
+        power_trace = log_writer.LogWriter(
+            f"{LOG_DIR}/{args.host_name}_power_trace.{extension}",
+            [("monotonic", "d", "%.6f"), ("power_watts", "f", "%.3f")]
+            + [(name, code, "%.3f") for name, code, _ in domain_fields],
+            **log_options,
         )
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    _, prev_idle, prev_total = get_cpu_utilization(0, 0)
-    prev_energy = None
-    prev_time = time.time()
+    stat_file = PinnedFile("/proc/stat", size=512)  # Only the first line is needed
+    _, prev_idle, prev_total = get_cpu_utilization(stat_file, 0, 0)
+    # Only fine sampling is smoothed; at one sample per report the RAPL
+    # energy delta already is the interval's mean power
+    tau = INTERVAL if args.sample_interval < INTERVAL else 0.0
+    power_avg = Ewma(tau=tau)
+    domain_avg = {label: Ewma(tau=tau) for label in sampler.labels}
+    unknown_labels = set()
+    samples_per_report = max(1, round(report_interval / args.sample_interval))
+    stats_reader = shm_stats.StatsReader(args.host_name) if args.throughput_source == "shm" else None
+    last_stats = None
+    seq = 0
+    pending = []
+
+    # Samples are scheduled on absolute monotonic deadlines, so time spent
+    # sampling and reporting does not accumulate as drift
+    next_sample = prev_sample = time.monotonic()
+    count = 0
 
     try:
         while True:
-            time.sleep(INTERVAL)
-            curr_time = time.time()
-            time_delta = curr_time - prev_time
+            next_sample += args.sample_interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -args.sample_interval:
+                # Fell behind (overload or suspend): drop the missed samples
+                # instead of bursting to catch up
+                next_sample += (-delay // args.sample_interval) * args.sample_interval
+            now = time.monotonic()
+            watts = sampler.sample(now)
+            if watts:
+                total = sampler.total(watts)
+                power_avg.update(total, now - prev_sample)
+                for label, w in watts.items():
+                    avg = domain_avg.get(label)
+                    if avg is None:
+                        # The feed's domain list changed (host daemon restarted);
+                        # log columns are fixed, so new domains are left out
+                        if label not in unknown_labels:
+                            unknown_labels.add(label)
+                            logging.warning(f"Ignoring power domain '{label}' not present at startup")
+                        continue
+                    avg.update(w, now - prev_sample)
+                if power_trace is not None:
+                    power_trace.write(
+                        [now, total] + [watts.get(label, 0.0) for label in sampler.labels]
+                    )
+                # Drivers may skip samples (no new data yet), so weight by
+                # the time since the last sample that arrived
+                prev_sample = now
+            count += 1
+            if count % samples_per_report:
+                continue
 
-            util, curr_idle, curr_total = get_cpu_utilization(prev_idle, prev_total)
-            power, curr_energy = get_power_watts(
-                args.driver, hwmon_path, prev_energy, time_delta
-            )
+            curr_time = time.time()
+            util, prev_idle, prev_total = get_cpu_utilization(stat_file, prev_idle, prev_total)
 
             mode = "REAL"
+            power = power_avg.value
             if power is None:
                 power = 10.0 + (util * 0.5)  # Fallback Simulation
                 mode = "SIM"
+            domains = tuple(
+                (label, avg.value) for label, avg in domain_avg.items() if avg.value is not None
+            )
 
             EPSILON = 1.0
 
-            # score = Throughput / Power
-            throughput = (
-                float(
-                    open(f"{LOG_DIR}/{args.host_name}_throughput.txt").read().strip()
-                    or 0
-                )
-                if os.path.exists(f"{LOG_DIR}/{args.host_name}_throughput.txt")
-                else 0.0
-            )
+            # score = Throughput / Power (the controller recomputes it from
+            # switch counters when it has them). The SIFT server replaces
+            # this file by rename, so it is reopened rather than pinned.
+            throughput = 0.0
+            latency = ""
+            if stats_reader is not None:
+                # Exact request count since the previous report
+                stats = stats_reader.read()
+                if stats is not None and last_stats is not None:
+                    throughput, busy, shed, buckets = stats.window(last_stats)
+                    p99 = shm_stats.latency_percentile(buckets, 0.99)
+                    if p99 is not None:
+                        latency = f" | Busy: {busy:.2f} | p99 < {p99 * 1000:.2f} ms"
+                    if shed or stats.depth:
+                        # Saturated: the server is refusing or queueing work
+                        latency += f" | Queue: {stats.depth} | Shed: {shed:.1f}/s"
+                last_stats = stats
+            elif args.throughput_source == "file" and os.path.exists(throughput_file):
+                throughput = float(open(throughput_file).read().strip() or 0)
             score = (throughput + EPSILON) / power if power > 0 else 0.0
 
-            # Log and Send Telemetry
-            with open(csv_file, "a", newline="") as f:
-                csv.writer(f).writerow(
-                    [
-                        curr_time,
-                        args.host_name,
-                        f"{util:.2f}",
-                        f"{throughput:.2f}",
-                        f"{power:.2f}",
-                        f"{score:.4f}",
-                    ]
-                )
-
-            sock.sendto(
-                f"{args.host_name},{score:.4f},{util:.2f}".encode(), (SWITCH_IP, PORT)
-            )
-            logging.info(
-                f"[{mode}] Driver: {args.driver} | Host: {args.host_name} | Score: {score:.3f} | Pwr: {power:.1f}W"
+            # Log every interval (queued to the writer thread), whether or
+            # not it is reported
+            energy_log.write(
+                [curr_time, args.host_name, util, throughput, power, score]
+                + [avg.value or 0.0 for avg in domain_avg.values()]
             )
 
-            # Update states
-            prev_idle, prev_total, prev_energy, prev_time = (
-                curr_idle,
-                curr_total,
-                curr_energy,
-                curr_time,
+            # Adaptive mode: stay quiet unless something moved or a heartbeat is due
+            reason = None
+            if gate is not None:
+                reason = gate.check(now, score, util)
+                if reason is None:
+                    continue
+                gate.mark_sent(now, score, util)
+
+            # Send Telemetry
+            if args.protocol == "text":
+                sock.sendto(
+                    f"{args.host_name},{score:.4f},{util:.2f}".encode(), (SWITCH_IP, PORT)
+                )
+            else:
+                pending.append(
+                    telemetry_protocol.TelemetrySample(
+                        args.host_name, seq, now, power, util, throughput, score, domains
+                    )
+                )
+                # Adaptive reports (changes and heartbeats) are pushed at
+                # once, whatever the batch size
+                if len(pending) >= args.batch or reason is not None:
+                    sock.sendto(telemetry_protocol.pack_samples(pending), (SWITCH_IP, PORT))
+                    pending = []
+            # seq counts sent samples only, so gaps at the controller mean loss
+            seq += 1
+            logging.info(
+                f"[{mode}{'|' + reason if reason else ''}] Driver: {args.driver} | Host: {args.host_name} | Score: {score:.3f} | Pwr: {power:.1f}W{latency}"
             )
 
     except KeyboardInterrupt:
         sock.close()
+    finally:
+        energy_log.close()
+        if power_trace is not None:
+            power_trace.close()
 
 
 if __name__ == "__main__":
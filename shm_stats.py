@@ -0,0 +1,184 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Shared-memory request statistics published by a SIFT server for the
+# server_agent on the same host. The segment is a file mapped by both
+# processes (native byte order):
+#
+#   seq u64 | requests u64 | busy ns u64 | shed u64 | queue depth u64 |
+#   LATENCY_BUCKETS x u64
+#
+# All counters except the queue depth (a gauge) are cumulative; shed counts
+# requests refused by the server's admission control. The server updates
+# them in place under a seqlock: seq is odd while a write is in progress,
+# and a reader retries until it sees the same even seq before and after
+# copying the counters.
+# Readers never block the server, and any two snapshots give exact counts
+# for the window between them.
+#
+# Latency bucket i counts requests that took [2^(i-1), 2^i) microseconds
+# (bucket 0: under 1 us); the last bucket is open-ended.
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+LATENCY_BUCKETS = 32
+_SEQ = struct.Struct("=Q")
+_COUNTERS = struct.Struct(f"={4 + LATENCY_BUCKETS}Q")
+_FIRST_BUCKET = 4
+SEGMENT_SIZE = _SEQ.size + _COUNTERS.size
+READ_RETRIES = 100
+
+
+def segment_path(identity):
+    return f"{SHM_DIR}/ea_{identity}.stats"
+
+
+def latency_bucket(seconds):
+    return min(LATENCY_BUCKETS - 1, int(seconds * 1000000).bit_length())
+
+
+class StatsWriter:
+    """Server side: counts requests into a fresh segment for identity.
+
+    Request handler threads serialize on a lock among themselves; readers
+    in other processes only follow the seqlock.
+    """
+
+    def __init__(self, identity):
+        self.path = segment_path(identity)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, SEGMENT_SIZE)
+            self.mm = mmap.mmap(fd, SEGMENT_SIZE)
+        finally:
+            os.close(fd)
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.counters = [0] * (_FIRST_BUCKET + LATENCY_BUCKETS)
+
+    def record(self, duration, depth=None, latency=None):
+        """Counts one request that kept the server busy for duration seconds.
+
+        latency (default duration) also includes the time spent queued;
+        depth is the request queue depth when it finished.
+        """
+        bucket = _FIRST_BUCKET + latency_bucket(duration if latency is None else latency)
+        with self.lock:
+            self.counters[0] += 1
+            self.counters[1] += int(duration * 1e9)
+            self.counters[bucket] += 1
+            if depth is not None:
+                self.counters[3] = depth
+            self._publish()
+
+    def record_shed(self, depth):
+        """Counts one request refused with the queue at depth."""
+        with self.lock:
+            self.counters[2] += 1
+            self.counters[3] = depth
+            self._publish()
+
+    def _publish(self):
+        self.seq += 1
+        _SEQ.pack_into(self.mm, 0, self.seq)
+        _COUNTERS.pack_into(self.mm, _SEQ.size, *self.counters)
+        self.seq += 1
+        _SEQ.pack_into(self.mm, 0, self.seq)
+
+    def close(self):
+        self.mm.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class StatsSnapshot:
+    def __init__(self, stamp, requests, busy_ns, shed, depth, buckets):
+        self.stamp = stamp        # time.monotonic() of the read
+        self.requests = requests
+        self.busy_ns = busy_ns
+        self.shed = shed
+        self.depth = depth
+        self.buckets = buckets
+
+    def window(self, earlier):
+        """(requests/s, busy fraction, shed/s, bucket deltas) since an earlier
+        snapshot.
+
+        A smaller counter means the server restarted; the window then
+        starts from zero.
+        """
+        elapsed = self.stamp - earlier.stamp
+        if elapsed <= 0:
+            return 0.0, 0.0, 0.0, [0] * LATENCY_BUCKETS
+        if self.requests < earlier.requests or self.shed < earlier.shed:
+            earlier = StatsSnapshot(earlier.stamp, 0, 0, 0, 0, [0] * LATENCY_BUCKETS)
+        requests = self.requests - earlier.requests
+        busy = (self.busy_ns - earlier.busy_ns) / 1e9
+        shed = self.shed - earlier.shed
+        buckets = [a - b for a, b in zip(self.buckets, earlier.buckets)]
+        return requests / elapsed, busy / elapsed, shed / elapsed, buckets
+
+
+def latency_percentile(buckets, q):
+    """Upper bound in seconds of the bucket holding quantile q, or None."""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= rank:
+            return (1 << i) / 1000000.0
+    return (1 << (LATENCY_BUCKETS - 1)) / 1000000.0
+
+
+class StatsReader:
+    """Agent side: lock-free snapshots of a server's segment.
+
+    The segment is mapped on first use and remapped when the server
+    recreates it, so the agent may start before or outlive the server.
+    """
+
+    def __init__(self, identity):
+        self.path = segment_path(identity)
+        self.mm = None
+        self.inode = None
+
+    def _map(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            st = os.fstat(fd)
+            if st.st_size < SEGMENT_SIZE:
+                return False
+            if self.mm is not None:
+                self.mm.close()
+            self.mm = mmap.mmap(fd, SEGMENT_SIZE, prot=mmap.PROT_READ)
+            self.inode = st.st_ino
+        finally:
+            os.close(fd)
+        return True
+
+    def read(self):
+        """Returns a StatsSnapshot, or None if no server publishes yet."""
+        try:
+            if os.stat(self.path).st_ino != self.inode and not self._map():
+                return None
+        except OSError:
+            return None
+        for _ in range(READ_RETRIES):
+            before = _SEQ.unpack_from(self.mm, 0)[0]
+            if before & 1:
+                continue
+            counters = _COUNTERS.unpack_from(self.mm, _SEQ.size)
+            if _SEQ.unpack_from(self.mm, 0)[0] == before:
+                return StatsSnapshot(time.monotonic(), *counters[:_FIRST_BUCKET],
+                                     list(counters[_FIRST_BUCKET:]))
+        return None
@@ -1,11 +1,18 @@
 import socket
 import argparse
 import os
-import threading
 import csv
 import time
+import sys
 import numpy as np
 
+# shm_stats lives at the repository root (search_engine and worker_pool next
+# to this file)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import shm_stats
+from search_engine import SearchEngine
+from worker_pool import QUEUE_SIZE, WorkerPool
+
 LOG_DIR = "logs"
 DATA_FILE = "sift_data/dataset.npy"
 MAX_VECTORS = 100000 
@@ -21,17 +28,16 @@ except Exception as e:
     print(f"CRITICAL ERROR: Could not load dataset: {e}")
     exit(1)
 
+# Norms are precomputed once; each query is one BLAS product into a
+# per-worker buffer (see search_engine.py)
+engine = SearchEngine(database_vectors)
+
 def vector_search_cpu(query_vector):
-    # 1. Subtract (Broadcasting)
-    diff = database_vectors - query_vector
-    # 2. Square and Sum (Einsum is faster)
-    sq_dists = np.einsum('ij,ij->i', diff, diff)
-    # 3. Partition to find top 1 
-    nearest_idx = np.argpartition(sq_dists, 1)[0]
-    return nearest_idx
+    return engine.search(query_vector)
 
-def handle_request(sock, addr, identity, csv_file, data):
+def handle_request(sock, addr, identity, csv_file, data, stats=None, pool=None, queued_at=None):
     start_ts = time.time()
+    start = time.perf_counter()
     try:
         query_vector = np.frombuffer(data, dtype=np.float32)
         
@@ -44,6 +50,11 @@ def handle_request(sock, addr, identity, csv_file, data):
         # Reply
         reply = f"Reply from {identity}: Match {result_idx}".encode()
         sock.sendto(reply, addr)
+
+        if stats is not None:
+            end = time.perf_counter()
+            stats.record(end - start, depth=pool.depth() if pool else None,
+                         latency=end - queued_at if queued_at else None)
         
         # Log
         duration_ms = (time.time() - start_ts) * 1000
@@ -53,7 +64,8 @@ def handle_request(sock, addr, identity, csv_file, data):
     except Exception as e:
         print(f"Error processing request: {e}")
 
-def run_server(port, server_id):
+def run_server(port, server_id, workers=None, queue_size=QUEUE_SIZE, shed_reply=False,
+               stats_shm=False):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind(("0.0.0.0", port))
     
@@ -64,25 +76,48 @@ def run_server(port, server_id):
     with open(csv_file, 'w', newline='') as f:
         csv.writer(f).writerow(["timestamp", "client_port", "processing_ms"])
 
-    print(f"--- SIFT Server {identity} Listening on {port} ---")
+    stats = shm_stats.StatsWriter(identity) if stats_shm else None
+
+    # A fixed pool works through a bounded queue; when it is full the
+    # request is shed (dropped, or answered BUSY) instead of piling up threads
+    workers = workers or os.cpu_count() or 1
+    pool = WorkerPool(handle_request, workers, queue_size, name=identity)
+    print(f"--- SIFT Server {identity} Listening on {port} ({workers} workers, queue {queue_size}) ---")
 
     while True:
         try:
-            # CLEAN LOOP: Receive data once, then process
+            # CLEAN LOOP: Receive data once, then hand it to the pool
             data, addr = sock.recvfrom(2048) 
             
-            # Use Threading to allow CPU to burn without blocking the receive loop
-            t = threading.Thread(target=handle_request, args=(sock, addr, identity, csv_file, data), daemon=True)
-            t.start()
+            if pool.submit(sock, addr, identity, csv_file, data, stats, pool, time.perf_counter()):
+                continue
+            if stats is not None:
+                stats.record_shed(pool.depth())
+            if shed_reply:
+                sock.sendto(f"BUSY from {identity}".encode(), addr)
+            if pool.shed % 1000 == 1:
+                print(f"--- Overloaded: {pool.shed} requests shed so far ---")
             
         except KeyboardInterrupt:
             break
         except Exception as e:
             print(f"Server Loop Error: {e}")
+    if stats:
+        stats.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=8080)
     parser.add_argument("--id", type=str, default="h2")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker threads (default: one per CPU)")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="Requests allowed to wait for a worker before shedding")
+    parser.add_argument("--shed", choices=["drop", "busy"], default="drop",
+                        help="Overload response: drop the request or reply BUSY")
+    parser.add_argument("--stats-shm", action="store_true",
+                        help="Publish request counts, latencies and shedding in shared memory "
+                             "for server_agent --throughput-source shm")
     args = parser.parse_args()
-    run_server(args.port, args.id)
\ No newline at end of file
+    run_server(args.port, args.id, args.workers, args.queue_size, args.shed == "busy",
+               args.stats_shm)
\ No newline at end of file
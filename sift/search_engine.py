@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+
+# Exact nearest-neighbour search over the SIFT database without per-query
+# allocations. Squared distances expand to ||x||^2 - 2 x.q + ||q||^2; the
+# database norms ||x||^2 are computed once, ||q||^2 is the same for every
+# row and does not change the ranking, so a query costs one BLAS
+# matrix-vector product (X.q) written into a buffer each worker thread
+# reuses, plus an in-place scale-and-add. A micro-batch of queries becomes
+# one matrix-matrix product (Q.X^T), so the database streams through the
+# cache once per batch instead of once per query.
+
+
+class SearchEngine:
+    def __init__(self, database):
+        self.database = np.ascontiguousarray(database, dtype=np.float32)
+        self.norms = np.einsum("ij,ij->i", self.database, self.database)
+        self.local = threading.local()
+
+    def _buffer(self):
+        buf = getattr(self.local, "dists", None)
+        if buf is None:
+            buf = self.local.dists = np.empty(len(self.database), dtype=np.float32)
+        return buf
+
+    def _batch_buffer(self, rows):
+        buf = getattr(self.local, "batch_dists", None)
+        if buf is None or len(buf) < rows:
+            buf = self.local.batch_dists = np.empty((rows, len(self.database)), dtype=np.float32)
+        return buf[:rows]
+
+    def distances(self, query):
+        """Squared distances to query, minus ||q||^2, in this thread's buffer.
+
+        The buffer is overwritten by the thread's next call.
+        """
+        dists = self._buffer()
+        np.dot(self.database, np.asarray(query, dtype=np.float32), out=dists)
+        dists *= -2.0
+        dists += self.norms
+        return dists
+
+    def batch_distances(self, queries):
+        """distances() for each row of queries, as an (m, n) view of this
+        thread's buffer."""
+        queries = np.asarray(queries, dtype=np.float32)
+        dists = self._batch_buffer(len(queries))
+        np.dot(queries, self.database.T, out=dists)
+        dists *= -2.0
+        dists += self.norms
+        return dists
+
+    def search_batch(self, queries, k=1):
+        """search() for each row of queries: an array of indices (k=1) or
+        one row of k nearest indices per query, closest first."""
+        dists = self.batch_distances(queries)
+        if k == 1:
+            return np.argmin(dists, axis=1)
+        nearest = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(dists, nearest, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(nearest, order, axis=1)
+
+    def search(self, query, k=1):
+        """Index of the nearest vector (k=1) or the k nearest, closest first."""
+        dists = self.distances(query)
+        if k == 1:
+            return int(np.argmin(dists))
+        nearest = np.argpartition(dists, k - 1)[:k]
+        return nearest[np.argsort(dists[nearest], kind="stable")]
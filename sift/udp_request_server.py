@@ -4,11 +4,20 @@ import os
 import threading
 import csv
 import time
+import sys
 import numpy as np
 
+# shm_stats lives at the repository root (search_engine and worker_pool next
+# to this file), next to the controllers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import shm_stats
+from search_engine import SearchEngine
+from worker_pool import QUEUE_SIZE, WorkerPool
+
 LOG_DIR = "logs"
 DATA_FILE = "sift_data/dataset.npy"
 MAX_VECTORS = 100000 
+BATCH_WAIT_US = 500  # Default micro-batch fill timeout (--batch-wait-us)
 
 # --- Global Metrics State ---
 request_count = 0
@@ -31,14 +40,12 @@ except Exception as e:
     print(f"CRITICAL ERROR: Could not load dataset: {e}")
     exit(1)
 
+# Norms are precomputed once; each query is one BLAS product into a
+# per-worker buffer (see search_engine.py)
+engine = SearchEngine(database_vectors)
+
 def vector_search_cpu(query_vector):
-    # 1. Subtract (Broadcasting)
-    diff = database_vectors - query_vector
-    # 2. Square and Sum (Einsum is faster)
-    sq_dists = np.einsum('ij,ij->i', diff, diff)
-    # 3. Partition to find top 1 
-    nearest_idx = np.argpartition(sq_dists, 1)[0]
-    return nearest_idx
+    return engine.search(query_vector)
 
 def throughput_monitor(identity, interval=0.5):
     """
@@ -69,37 +76,94 @@ def throughput_monitor(identity, interval=0.5):
         except Exception as e:
             print(f"Monitor Error: {e}")
 
-def handle_request(sock, addr, identity, csv_file, data):
+def parse_request(data):
+    """Returns (query vector, request id), or None for a short datagram."""
+    if len(data) < 512: return None
+    query_vector = np.frombuffer(data[:512], dtype=np.float32)
+    
+    # Parse Request ID
+    try:
+        req_id= data[515:].decode('utf-8')
+    except:
+        req_id = -1
+    return query_vector, req_id
+
+def complete_request(sock, addr, identity, req_id, result_idx, start_ts, busy,
+                     count_requests=False, stats=None, pool=None, queued_at=None):
+    """Replies and counts one request; returns its work log row."""
     global request_count
+    reply = f"Reply from {identity} ID:{req_id} : Match {result_idx}".encode()
+    sock.sendto(reply, addr)
+    
+    # Count the request in the shared-memory segment read by the agent
+    if stats is not None:
+        stats.record(busy, depth=pool.depth() if pool else None,
+                     latency=time.perf_counter() - queued_at if queued_at else None)
+
+    # Increment throughput counter (read by the throughput file monitor)
+    if count_requests:
+        with request_lock:
+            request_count += 1
+
+    duration_ms = (time.time() - start_ts) * 1000
+    return [start_ts, addr[1], duration_ms]
+
+def write_work_log(csv_file, rows):
+    with open(csv_file, 'a', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+def handle_request(sock, addr, identity, csv_file, data, count_requests=False, stats=None,
+                   pool=None, queued_at=None):
     start_ts = time.time()
+    start = time.perf_counter()
     try:
-        if len(data) < 512: return
-        query_vector = np.frombuffer(data[:512], dtype=np.float32)
-        
-        # Parse Request ID
-        try:
-            req_id= data[515:].decode('utf-8')
-        except:
-            req_id = -1
+        request = parse_request(data)
+        if request is None: return
+        query_vector, req_id = request
 
         result_idx = vector_search_cpu(query_vector)
         
-        reply = f"Reply from {identity} ID:{req_id} : Match {result_idx}".encode()
-        sock.sendto(reply, addr)
-        
+        row = complete_request(sock, addr, identity, req_id, result_idx, start_ts,
+                               time.perf_counter() - start, count_requests, stats, pool, queued_at)
+
         # Log work duration
-        duration_ms = (time.time() - start_ts) * 1000
-        with open(csv_file, 'a', newline='') as f:
-            csv.writer(f).writerow([start_ts, addr[1], duration_ms])
-        
-        # Increment throughput counter
-        with request_lock:
-            request_count += 1
+        write_work_log(csv_file, [row])
             
     except Exception as e:
         print(f"Error processing request: {e}")
 
-def run_server(port, server_id):
+def handle_batch(batch):
+    """Micro-batched handle_request: one matrix-matrix search for up to
+    --batch queries, then one reply per request."""
+    start_ts = time.time()
+    start = time.perf_counter()
+    try:
+        requests = []
+        for args in batch:
+            request = parse_request(args[4])
+            if request is not None:
+                requests.append((args, request))
+        if not requests: return
+
+        results = engine.search_batch(np.stack([q for _, (q, _) in requests]))
+
+        # The batch's busy time is shared evenly by its requests
+        busy = (time.perf_counter() - start) / len(requests)
+        rows = []
+        for (args, (_, req_id)), result_idx in zip(requests, results):
+            sock, addr, identity, csv_file, _, count_requests, stats, pool, queued_at = args
+            rows.append(complete_request(sock, addr, identity, req_id, int(result_idx), start_ts,
+                                         busy, count_requests, stats, pool, queued_at))
+
+        # Log work duration
+        write_work_log(csv_file, rows)
+
+    except Exception as e:
+        print(f"Error processing batch: {e}")
+
+def run_server(port, server_id, throughput_file=True, stats_shm=False,
+               workers=None, queue_size=QUEUE_SIZE, shed_reply=False,
+               batch=1, batch_wait_us=BATCH_WAIT_US):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind(("0.0.0.0", port))
     
@@ -110,28 +174,70 @@ def run_server(port, server_id):
     with open(csv_file, 'w', newline='') as f:
         csv.writer(f).writerow(["timestamp", "client_port", "processing_ms"])
 
-    # Start Throughput Monitor Thread
-    t_mon = threading.Thread(target=throughput_monitor, args=(identity,), daemon=True)
-    t_mon.start()
+    # The throughput file is what server_agent reads by default; the
+    # shared-memory stats and the switch counters are opt-in alternatives
+    if throughput_file:
+        t_mon = threading.Thread(target=throughput_monitor, args=(identity,), daemon=True)
+        t_mon.start()
+    stats = shm_stats.StatsWriter(identity) if stats_shm else None
+    if stats:
+        print(f"--- Publishing request stats in {stats.path} ---")
 
-    print(f"--- SIFT Server {identity} Listening on {port} ---")
+    # A fixed pool works through a bounded queue; when it is full the
+    # request is shed (dropped, or answered BUSY) instead of piling up threads
+    workers = workers or os.cpu_count() or 1
+    if batch > 1:
+        # Each worker takes up to `batch` queued requests, waiting at most
+        # batch_wait_us for the batch to fill
+        pool = WorkerPool(handle_batch, workers, queue_size, name=identity,
+                          batch=batch, batch_wait=batch_wait_us / 1e6)
+        print(f"--- Micro-batching up to {batch} queries, waiting at most {batch_wait_us} us ---")
+    else:
+        pool = WorkerPool(handle_request, workers, queue_size, name=identity)
+    print(f"--- SIFT Server {identity} Listening on {port} ({workers} workers, queue {queue_size}) ---")
 
     while True:
         try:
             data, addr = sock.recvfrom(2048) 
             
-            # Use Threading to allow CPU to burn without blocking
-            t = threading.Thread(target=handle_request, args=(sock, addr, identity, csv_file, data), daemon=True)
-            t.start()
+            if pool.submit(sock, addr, identity, csv_file, data, throughput_file, stats,
+                           pool, time.perf_counter()):
+                continue
+            if stats is not None:
+                stats.record_shed(pool.depth())
+            if shed_reply:
+                sock.sendto(f"BUSY from {identity}".encode(), addr)
+            if pool.shed % 1000 == 1:
+                print(f"--- Overloaded: {pool.shed} requests shed so far ---")
             
         except KeyboardInterrupt:
             break
         except Exception as e:
             print(f"Server Loop Error: {e}")
+    if stats:
+        stats.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=8080) # Default P4 tutorial port usually
     parser.add_argument("--id", type=str, default="h1")
+    parser.add_argument("--no-throughput-file", dest="throughput_file", action="store_false",
+                        help="Stop writing logs/{id}_throughput.txt (server_agent's default "
+                             "--throughput-source file reads it)")
+    parser.add_argument("--stats-shm", action="store_true",
+                        help="Publish request counts and latencies in shared memory "
+                             "for server_agent --throughput-source shm")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker threads (default: one per CPU)")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="Requests allowed to wait for a worker before shedding")
+    parser.add_argument("--shed", choices=["drop", "busy"], default="drop",
+                        help="Overload response: drop the request or reply BUSY")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="Micro-batch up to this many queries per search (1 disables batching)")
+    parser.add_argument("--batch-wait-us", type=int, default=BATCH_WAIT_US,
+                        help="Longest wait for a micro-batch to fill, in microseconds")
     args = parser.parse_args()
-    run_server(args.port, args.id)
\ No newline at end of file
+    run_server(args.port, args.id, args.throughput_file, args.stats_shm,
+               args.workers, args.queue_size, args.shed == "busy",
+               args.batch, args.batch_wait_us)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import queue
+import threading
+import time
+
+# Fixed-size worker pool with admission control for the SIFT UDP servers.
+# The receive loop submits each datagram to a bounded queue; when the queue
+# is full the request is shed at once instead of spawning yet another
+# thread, so overload shows up as explicit drops rather than exploding tail
+# latency.
+#
+# With batch > 1 each worker hands the handler a list of up to `batch`
+# argument tuples: it takes the first queued request, then waits at most
+# batch_wait seconds for more.
+
+QUEUE_SIZE = 64
+
+
+class WorkerPool:
+    def __init__(self, handler, workers, queue_size=QUEUE_SIZE, name="worker",
+                 batch=1, batch_wait=0.0):
+        self.handler = handler
+        self.batch = batch
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.shed = 0  # Requests refused because the queue was full (receive thread only)
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, *args):
+        """Queues handler(*args); returns False (and counts a shed) if full."""
+        try:
+            self.queue.put_nowait(args)
+            return True
+        except queue.Full:
+            self.shed += 1
+            return False
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch:
+            try:
+                # Drain what is already queued before waiting for more
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                if self.batch > 1:
+                    self.handler(self._next_batch())
+                else:
+                    self.handler(*self.queue.get())
+            except Exception as e:
+                print(f"Worker Error: {e}")
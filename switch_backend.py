@@ -0,0 +1,125 @@
+import time
+
+import ecmp_slots
+
+# Target-specific access to the load balancer's tables. The controller core
+# (controller_core.py) only ever asks a backend to install the static rules,
+# report the installed ECMP assignment and reweight the servers;
+# BMv2/P4Runtime and Tofino/BFRT implement this next to their controllers,
+# and InMemoryBackend models the tables in plain dicts for tests and
+# large-pool benchmarks.
+
+
+class SwitchBackend:
+    """Interface the controller core programs the switch through.
+
+    server_info maps hostname -> {"ip", "mac", "port"} for every backend
+    server the switch can forward to.
+    """
+
+    server_info = {}
+    write_errors = 0  # Switch writes that failed, fully or in part
+
+    def start(self, metrics):
+        """Connects, loads what the switch already holds and installs the
+        static rules. Writes are recorded in metrics (ControllerMetrics)."""
+        raise NotImplementedError
+
+    def installed_ecmp(self):
+        """Returns the installed ecmp_nhop assignment as {slot: hostname}."""
+        raise NotImplementedError
+
+    def write_ecmp(self, assignment):
+        """Makes ecmp_nhop match {slot: hostname}; slots not listed are
+        removed. Returns the number of entries written."""
+        raise NotImplementedError
+
+    def write_weights(self, weights):
+        """Shares traffic between servers in proportion to {hostname: weight}.
+
+        The default spreads the ECMP slots with minimal churn; targets with
+        another selection mechanism override it. Returns the writes made.
+        """
+        return self.write_ecmp(ecmp_slots.assign_slots(self.installed_ecmp(), weights))
+
+    def read_counters(self):
+        """Cumulative per-server traffic as {hostname: (request packets,
+        reply packets, reply bytes)}, or None if the target has no counters."""
+        return None
+
+    def verify(self):
+        """Prints a summary of the switch tables."""
+
+
+def synthetic_server_info(count):
+    """server_info for `count` simulated servers b0..b{count-1}."""
+    info = {}
+    for i in range(count):
+        info[f"b{i}"] = {
+            "ip": f"10.{100 + i // 65536}.{(i // 256) % 256}.{i % 256}",
+            "mac": "02:00:00:%02x:%02x:%02x" % ((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF),
+            "port": 2 + i % 62,
+        }
+    return info
+
+
+class InMemoryBackend(SwitchBackend):
+    """Models send_frame, server_src_nat and ecmp_nhop as dicts.
+
+    Each write_ecmp() counts as one switch write and can be delayed by
+    write_latency seconds to mimic a remote switch.
+    """
+
+    def __init__(self, server_info, client_ip="10.0.1.1", client_mac="08:00:00:00:01:01",
+                 client_port=1, write_latency=0.0):
+        self.server_info = server_info
+        self.client_ip = client_ip
+        self.client_mac = client_mac
+        self.client_port = client_port
+        self.write_latency = write_latency
+        self.metrics = None
+        self.send_frame = {}      # egress port -> source MAC
+        self.server_src_nat = {}  # (server ip, client ip) -> (client MAC, client port)
+        self.ecmp_nhop = {}       # slot -> (server MAC, server IP, port)
+        self.write_calls = 0
+        self.updates_written = 0
+        self.last_write_done = None
+
+    def start(self, metrics):
+        self.metrics = metrics
+        self.send_frame[self.client_port] = self.client_mac
+        for info in self.server_info.values():
+            self.send_frame[info["port"]] = info["mac"]
+            self.server_src_nat[(info["ip"], self.client_ip)] = (self.client_mac, self.client_port)
+
+    def installed_ecmp(self):
+        ip_to_host = {info["ip"]: host for host, info in self.server_info.items()}
+        return {slot: ip_to_host.get(ip) for slot, (_, ip, _) in self.ecmp_nhop.items()}
+
+    def write_ecmp(self, assignment):
+        desired = {}
+        for slot, host in assignment.items():
+            info = self.server_info[host]
+            desired[slot] = (info["mac"], info["ip"], info["port"])
+        changed = [s for s, nhop in desired.items() if self.ecmp_nhop.get(s) != nhop]
+        stale = [s for s in self.ecmp_nhop if s not in desired]
+        self.metrics.table_writes.inc(("skipped",), len(desired) - len(changed))
+        if not (changed or stale):
+            return 0
+
+        self.metrics.table_writes.inc(("issued",), len(changed) + len(stale))
+        with self.metrics.switch_write.time():
+            if self.write_latency:
+                time.sleep(self.write_latency)
+            for slot in changed:
+                self.ecmp_nhop[slot] = desired[slot]
+            for slot in stale:
+                del self.ecmp_nhop[slot]
+        self.write_calls += 1
+        self.updates_written += len(changed) + len(stale)
+        self.last_write_done = time.monotonic()
+        return len(changed) + len(stale)
+
+    def verify(self):
+        print(f"  [OK] send_frame: {len(self.send_frame)}, server_src_nat: "
+              f"{len(self.server_src_nat)}, ecmp_nhop: {len(self.ecmp_nhop)} entries")
@@ -0,0 +1,78 @@
+from p4.v1 import p4runtime_pb2
+
+# In-memory shadow of the P4Runtime table entries this controller owns.
+# It is loaded from one wildcard read, and every write is planned against
+# it so entries that already match on the switch are never rewritten.
+
+
+def canonical_bytes(value):
+    """Canonical P4Runtime bytestring: switches may strip leading zeros."""
+    return value.lstrip(b"\x00") or b"\x00"
+
+
+def entry_key(entry):
+    match = []
+    for m in entry.match:
+        if m.WhichOneof("field_match_type") == "exact":
+            match.append((m.field_id, canonical_bytes(m.exact.value)))
+        else:
+            match.append((m.field_id, m.SerializeToString(deterministic=True)))
+    return (entry.table_id, tuple(sorted(match)), entry.priority)
+
+
+def entry_action(entry):
+    action = entry.action.action
+    params = tuple(sorted((p.param_id, canonical_bytes(p.value)) for p in action.params))
+    return (action.action_id, params)
+
+
+class TableShadow:
+    def __init__(self, table_ids):
+        self.table_ids = set(table_ids)
+        self.entries = {}  # entry_key -> TableEntry
+
+    def load(self, read_responses):
+        """Replaces the shadow with the owned entries found in ReadResponses."""
+        self.entries = {}
+        for response in read_responses:
+            for entity in response.entities:
+                entry = entity.table_entry
+                if entry.table_id in self.table_ids and not entry.is_default_action:
+                    self.entries[entry_key(entry)] = entry
+
+    def entries_of(self, table_id):
+        return [e for e in self.entries.values() if e.table_id == table_id]
+
+    def plan(self, desired, prune_table_ids=()):
+        """Returns the (update_type, entry) list that turns the shadow into desired.
+
+        Entries already installed with the same action are skipped. Entries of
+        prune_table_ids that are not in desired are deleted.
+        """
+        updates = []
+        wanted = set()
+        for entry in desired:
+            key = entry_key(entry)
+            wanted.add(key)
+            current = self.entries.get(key)
+            if current is None:
+                updates.append((p4runtime_pb2.Update.INSERT, entry))
+            elif entry_action(current) != entry_action(entry):
+                updates.append((p4runtime_pb2.Update.MODIFY, entry))
+
+        for key, current in self.entries.items():
+            if current.table_id in prune_table_ids and key not in wanted:
+                stale = p4runtime_pb2.TableEntry()
+                stale.table_id = current.table_id
+                stale.priority = current.priority
+                stale.match.extend(current.match)
+                updates.append((p4runtime_pb2.Update.DELETE, stale))
+        return updates
+
+    def commit(self, update_type, entry):
+        """Records an update the switch accepted."""
+        key = entry_key(entry)
+        if update_type == p4runtime_pb2.Update.DELETE:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = entry
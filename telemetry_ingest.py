@@ -0,0 +1,72 @@
+import asyncio
+
+import telemetry_protocol
+
+# Shared asyncio ingestion path for the bmv2 and Tofino controllers.
+# Agent reports are drained into the controller as they arrive, but the
+# policy runs at most once per tick, so decision cost scales with ticks
+# rather than with the number of agents.
+
+LISTEN_ADDR = "0.0.0.0"
+LISTEN_PORT = 50001
+TICK_INTERVAL = 0.1  # Seconds between policy evaluations
+
+
+class TelemetryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, controller):
+        self.controller = controller
+        self.dirty = False
+
+    def datagram_received(self, data, addr):
+        metrics = self.controller.metrics
+        try:
+            samples = telemetry_protocol.parse_datagram(data)
+        except Exception as e:
+            metrics.parse_errors.inc()
+            print(f"Error parsing message: {e}")
+            return
+        self.on_samples(samples)
+
+    def on_samples(self, samples):
+        metrics = self.controller.metrics
+        for sample in samples:
+            metrics.observe_report(sample.host, sample.seq)
+            self.controller.ingest_report(
+                sample.host, sample.score, sample.util, sample.power, sample.domains)
+        self.dirty = True
+
+
+async def _serve(controller, host, port, tick_interval, protocol_cls):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: protocol_cls(controller), local_addr=(host, port)
+    )
+    try:
+        while True:
+            await asyncio.sleep(tick_interval)
+            try:
+                controller.on_tick()
+            except Exception as e:
+                print(f"Error on controller tick: {e}")
+            if not protocol.dirty:
+                continue
+            protocol.dirty = False
+            try:
+                controller.recompute_and_update()
+            except Exception as e:
+                print(f"Error recomputing policy: {e}")
+    finally:
+        transport.close()
+
+
+def serve(controller, host=LISTEN_ADDR, port=LISTEN_PORT, tick_interval=TICK_INTERVAL,
+          protocol_cls=TelemetryProtocol):
+    """Runs the ingestion loop forever, calling controller.ingest_report per
+    report, controller.on_tick every tick and controller.recompute_and_update
+    at most once per tick.
+    Reports and parse errors are counted in controller.metrics."""
+    print(f"Starting UDP Listener on Port {port} (tick {tick_interval * 1000:.0f} ms)...")
+    try:
+        asyncio.run(_serve(controller, host, port, tick_interval, protocol_cls))
+    except KeyboardInterrupt:
+        pass
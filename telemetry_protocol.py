@@ -0,0 +1,129 @@
+import struct
+from collections import namedtuple
+
+# Binary agent -> controller telemetry frame (network byte order):
+#
+#   header : magic "EA" | version u8 | sample count u8
+#   sample : host name 16s (NUL padded) | seq u32 | monotonic ts f64 |
+#            power W f32 | cpu util % f32 | throughput rps f32 | score f32
+#   version 2 appends to each sample:
+#            domain count u8 | count x (domain name 12s | power W f32)
+#
+# power is always the whole-server total; version 2 also breaks it down per
+# RAPL/hwmon domain. Version 1 frames are still sent when no sample carries
+# domains, and both versions are accepted.
+#
+# Several samples may share one datagram. Anything that does not start with
+# the magic is treated as the legacy "host,score,util" text report.
+
+MAGIC = b"EA"
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct("!2sBB")
+SAMPLE = struct.Struct("!16sIdffff")
+DOMAIN_COUNT = struct.Struct("!B")
+DOMAIN = struct.Struct("!12sf")
+MAX_SAMPLES_PER_FRAME = 255
+MAX_DOMAINS = 255
+HOST_NAME_LEN = 16
+DOMAIN_NAME_LEN = 12
+
+# domains: ((name, watts), ...), empty when the agent sent none
+TelemetrySample = namedtuple(
+    "TelemetrySample",
+    ["host", "seq", "timestamp", "power", "util", "throughput", "score", "domains"],
+    defaults=((),),
+)
+
+
+def pack_samples(samples):
+    """Packs up to MAX_SAMPLES_PER_FRAME TelemetrySamples into one frame."""
+    if len(samples) > MAX_SAMPLES_PER_FRAME:
+        raise ValueError(f"At most {MAX_SAMPLES_PER_FRAME} samples per frame")
+    version = 2 if any(s.domains for s in samples) else 1
+    size = HEADER.size + SAMPLE.size * len(samples)
+    if version == 2:
+        size += sum(DOMAIN_COUNT.size + DOMAIN.size * len(s.domains) for s in samples)
+    frame = bytearray(size)
+    HEADER.pack_into(frame, 0, MAGIC, version, len(samples))
+    offset = HEADER.size
+    for s in samples:
+        host = s.host.encode()
+        if len(host) > HOST_NAME_LEN:
+            raise ValueError(f"Host name '{s.host}' longer than {HOST_NAME_LEN} bytes")
+        SAMPLE.pack_into(
+            frame, offset, host, s.seq & 0xFFFFFFFF, s.timestamp,
+            s.power, s.util, s.throughput, s.score,
+        )
+        offset += SAMPLE.size
+        if version == 1:
+            continue
+        if len(s.domains) > MAX_DOMAINS:
+            raise ValueError(f"At most {MAX_DOMAINS} power domains per sample")
+        DOMAIN_COUNT.pack_into(frame, offset, len(s.domains))
+        offset += DOMAIN_COUNT.size
+        for name, watts in s.domains:
+            encoded = name.encode()
+            if len(encoded) > DOMAIN_NAME_LEN:
+                raise ValueError(f"Domain name '{name}' longer than {DOMAIN_NAME_LEN} bytes")
+            DOMAIN.pack_into(frame, offset, encoded, watts)
+            offset += DOMAIN.size
+    return bytes(frame)
+
+
+def unpack_samples(data):
+    """Decodes a binary frame into a list of TelemetrySamples."""
+    magic, version, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a binary telemetry frame")
+    if version == 1:
+        return _unpack_v1(data, count)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported telemetry version {version}")
+    samples = []
+    offset = HEADER.size
+    try:
+        for _ in range(count):
+            host, seq, ts, power, util, throughput, score = SAMPLE.unpack_from(data, offset)
+            offset += SAMPLE.size
+            (n,) = DOMAIN_COUNT.unpack_from(data, offset)
+            offset += DOMAIN_COUNT.size
+            domains = []
+            for _ in range(n):
+                name, watts = DOMAIN.unpack_from(data, offset)
+                domains.append((name.rstrip(b"\0").decode(), watts))
+                offset += DOMAIN.size
+            samples.append(TelemetrySample(
+                host.rstrip(b"\0").decode(), seq, ts, power, util, throughput, score,
+                tuple(domains),
+            ))
+    except struct.error:
+        raise ValueError(f"Truncated frame: {len(data)} bytes for {count} samples")
+    if offset != len(data):
+        raise ValueError(f"Trailing bytes in frame: {len(data) - offset}")
+    return samples
+
+
+def _unpack_v1(data, count):
+    if len(data) != HEADER.size + SAMPLE.size * count:
+        raise ValueError(f"Truncated frame: {len(data)} bytes for {count} samples")
+    samples = []
+    for host, seq, ts, power, util, throughput, score in SAMPLE.iter_unpack(
+        memoryview(data)[HEADER.size:]
+    ):
+        samples.append(TelemetrySample(
+            host.rstrip(b"\0").decode(), seq, ts, power, util, throughput, score
+        ))
+    return samples
+
+
+def parse_legacy(data):
+    """Decodes a legacy 'host,score,util' text report."""
+    host, score, util = data.decode().strip().split(",")
+    return TelemetrySample(host, None, None, None, float(util), None, float(score))
+
+
+def parse_datagram(data):
+    """Returns the samples carried by one datagram, binary or legacy text."""
+    if data[:2] == MAGIC:
+        return unpack_samples(data)
+    return [parse_legacy(data)]
@@ -0,0 +1,30 @@
+import controller_core
+from decision_damper import DecisionDamper
+from switch_backend import InMemoryBackend, synthetic_server_info
+
+
+def test_move_to_better_tier_skips_the_margin():
+    damper = DecisionDamper(min_dwell=0, higher_is_better=True)
+    tiers = {"b0": 1, "b1": 0}
+    scores = {"b0": 1.0, "b1": 0.5}
+    damper.commit([("b0", 1.0)])
+    assert damper.admit([("b1", 0.5)], value_of=scores.get, tier_of=tiers.get)
+    # Without the tiers the lower score never clears the margin
+    assert not damper.admit([("b1", 0.5)], value_of=scores.get)
+
+
+def test_energy_aware_leaves_a_busy_winner():
+    damper = DecisionDamper(min_dwell=0, higher_is_better=True)
+    ctrl = controller_core.LBController(
+        InMemoryBackend(synthetic_server_info(2)), damper=damper,
+        metrics_port=None, listen=False)
+    ctrl.ingest_report("b0", 1.0, 10.0, 10.0)
+    ctrl.ingest_report("b1", 0.5, 10.0, 10.0)
+    ctrl.recompute_and_update(1)
+    assert damper.current == ["b0"]
+
+    ctrl.ingest_report("b0", 1.0, 95.0, 10.0)  # Busy, still the best score
+    ctrl.recompute_and_update(1)
+    assert damper.current == ["b1"]
+    assert set(ctrl.installed_keys.values()) == {"b1"}
+    assert damper.counters["suppressed_hysteresis"] == 0
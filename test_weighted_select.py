@@ -0,0 +1,29 @@
+from weighted_select import MAX_BACKENDS, assign_indices
+
+
+def full_pool():
+    return {i: f"h{i}" for i in range(MAX_BACKENDS)}
+
+
+def test_incumbents_keep_their_index():
+    current = {0: "h0", 1: "h1"}
+    weights = {"h1": 3.0, "h0": 1.0, "h2": 2.0}
+    assert assign_indices(current, weights) == {0: "h0", 1: "h1", 2: "h2"}
+
+
+def test_heavier_newcomer_evicts_lightest_incumbent_when_full():
+    current = full_pool()
+    weights = {host: 1.0 + i for i, host in current.items()}
+    weights["new"] = 100.0
+    assignment = assign_indices(current, weights)
+    assert assignment[0] == "new"  # h0 was the lightest
+    assert {i: h for i, h in assignment.items() if i} == {i: f"h{i}" for i in range(1, MAX_BACKENDS)}
+
+
+def test_lighter_or_equal_newcomer_waits_when_full():
+    current = full_pool()
+    weights = {host: 1.0 for host in current.values()}
+    weights["new"] = 1.0
+    assert assign_indices(current, weights) == current
+    weights["new"] = 0.5
+    assert assign_indices(current, weights) == current
@@ -0,0 +1,79 @@
+import struct
+
+import ecmp_slots
+
+# Python reference model of the register-driven backend selection in
+# p4src/load_balance.p4. Each flow hashes to a point in [0, WEIGHT_SCALE);
+# the cum_weight register holds one cumulative upper bound per backend
+# index, and the flow goes to the first backend whose bound exceeds its
+# point. Reweighting the pool is one bulk write of MAX_BACKENDS cells.
+
+MAX_BACKENDS = 8     # Must match MAX_BACKENDS / cum_weight size in p4src/load_balance.p4
+WEIGHT_SCALE = 1024  # Must match WEIGHT_SCALE in p4src/load_balance.p4
+
+_FLOW_KEY = struct.Struct("!IIBHHHH")
+
+
+def crc16(data):
+    """CRC-16/ARC, the algorithm BMv2 uses for HashAlgorithm.crc16."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def flow_point(src_ip, dst_ip, protocol, tcp_ports=(0, 0), udp_ports=(0, 0),
+               scale=WEIGHT_SCALE):
+    """Point in [0, scale) the data plane derives from a flow's 5-tuple.
+
+    IPs are integers; ports of the absent transport header are 0, as BMv2
+    reads fields of invalid headers.
+    """
+    key = _FLOW_KEY.pack(src_ip, dst_ip, protocol, *tcp_ports, *udp_ports)
+    return crc16(key) % scale
+
+
+def cumulative_bounds(weights, max_backends=MAX_BACKENDS, scale=WEIGHT_SCALE):
+    """cum_weight register contents for {backend index: weight}.
+
+    Shares are apportioned in integer units of 1/scale (largest remainder),
+    so the last used bound is exactly scale; unused cells repeat the last
+    bound and can never be selected.
+    """
+    shares = ecmp_slots.apportion(weights, scale)
+    bounds = []
+    total = 0
+    for index in range(max_backends):
+        total += shares.get(index, 0)
+        bounds.append(total)
+    return bounds
+
+
+def select_backend(point, bounds):
+    """Backend index the data plane picks for a flow point (0 if none)."""
+    for index, bound in enumerate(bounds):
+        if point < bound:
+            return index
+    return 0
+
+
+def assign_indices(current, weights, max_backends=MAX_BACKENDS):
+    """Stable {index: host} for the max_backends heaviest hosts in weights.
+
+    Admitted hosts keep their index in current; ties favour hosts already
+    placed, so equal weights cause no churn. Incumbents that are no longer
+    listed, or that a heavier newcomer pushes out of the top max_backends,
+    free their index for the newcomers.
+    """
+    placed = set(current.values())
+    ranked = sorted(weights, key=lambda h: (weights[h], h in placed), reverse=True)
+    admitted = set(ranked[:max_backends])
+    assignment = {i: h for i, h in current.items() if h in admitted}
+    kept = set(assignment.values())
+    free = [i for i in range(max_backends) if i not in assignment]
+    for host in ranked[:max_backends]:
+        if host not in kept and free:
+            assignment[free.pop(0)] = host
+    return assignment